@@ -0,0 +1,46 @@
+"""Микробенчмарк кодеков кэша на списках пользователей из 1, 100 и 10k строк.
+
+Для каждого кодека: размер значения, dumps, loads и путь ответа на попадание в кэш -
+"parse + reserialize" (loads из Redis и повторный JSON для ответа, как было) против
+"pass-through" (байты из Redis сразу в тело ответа, только для JSON-совместимых кодеков).
+
+    python bench/cache_codecs.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "user_service"))
+from app.codecs import CODECS  # noqa: E402
+
+
+def users(rows: int):
+    return [
+        {"id": i, "login": f"user{i}", "full_name": f"User Number {i}", "email": f"user{i}@example.com"}
+        for i in range(1, rows + 1)
+    ]
+
+
+def per_call_us(func, rows: int) -> float:
+    number = max(3, 20000 // rows)
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print(f"{'rows':>6} {'codec':>8} {'bytes':>9} {'dumps us':>10} {'loads us':>10} "
+          f"{'parse+json us':>14} {'pass-through us':>16}")
+    for rows in (1, 100, 10000):
+        value = users(rows)
+        for name, codec in CODECS.items():
+            raw = codec.dumps(value)
+            dumps_us = per_call_us(lambda: codec.dumps(value), rows)
+            loads_us = per_call_us(lambda: codec.loads(raw), rows)
+            reserialize_us = per_call_us(lambda: json.dumps(codec.loads(raw)).encode(), rows)
+            passthrough = f"{per_call_us(lambda: bytes(raw), rows):16.2f}" if codec.json_compatible else f"{'-':>16}"
+            print(f"{rows:>6} {name:>8} {len(raw):>9} {dumps_us:>10.2f} {loads_us:>10.2f} "
+                  f"{reserialize_us:>14.2f} {passthrough}")
+
+
+if __name__ == "__main__":
+    main()
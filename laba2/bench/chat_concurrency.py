@@ -0,0 +1,63 @@
+"""Как пропускная способность chat_service растёт с числом одновременных запросов.
+
+Гоняет GET /chats/{chat_id}/messages на разных уровнях конкурентности. Пока обработчики
+блокировали event loop синхронным pymongo, req/s почти не рос с ростом конкурентности:
+
+    python bench/chat_concurrency.py --login admin --password secret --chat-id 1
+
+Без MongoDB - против bench/chat_service_mock_mongo.py с MOCK_MONGO_LATENCY_MS
+(и MOCK_MONGO_BLOCKING=1 для сравнения с блокирующим драйвером).
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def get_token(user_service: str, login: str, password: str) -> str:
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"{user_service}/token",
+            data={"username": login, "password": password}
+        )
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+
+async def run_level(client, url, headers, concurrency, total):
+    async def worker(count):
+        for _ in range(count):
+            response = await client.get(url, headers=headers)
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(total // concurrency) for _ in range(concurrency)])
+    return total / (time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-service", default="http://localhost:8000")
+    parser.add_argument("--chat-service", default="http://localhost:8001")
+    parser.add_argument("--login", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("--levels", default="1,2,4,8,16,32,64")
+    parser.add_argument("--limit", type=int, default=100, help="сколько сообщений на страницу")
+    args = parser.parse_args()
+
+    token = await get_token(args.user_service, args.login, args.password)
+    headers = {"Authorization": f"Bearer {token}"}
+    url = f"{args.chat_service}/chats/{args.chat_id}/messages?limit={args.limit}"
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits) as client:
+        for level in [int(level) for level in args.levels.split(",")]:
+            rps = await run_level(client, url, headers, level, args.requests)
+            print(f"concurrency {level:>3}: {rps:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""chat_service с MongoDB в памяти (mongomock-motor) для нагрузочных замеров без Mongo.
+
+Меряется только сам chat_service (event loop, проверка токена, походы в user_service).
+У mongomock нет сетевой задержки, поэтому её можно добавить искусственно:
+
+    MOCK_MONGO_LATENCY_MS=5    - каждый вызов MongoDB ждёт 5 мс через asyncio.sleep (async-драйвер)
+    MOCK_MONGO_BLOCKING=1      - ждёт через time.sleep, блокируя event loop, как синхронный
+                                 pymongo внутри async-обработчика (до перехода на AsyncMongoClient)
+
+Запускать из каталога laba2:
+
+    pip install mongomock-motor
+    uvicorn bench.user_service_stub:app --port 8000 &
+    USER_SERVICE_URL=http://127.0.0.1:8000 uvicorn bench.chat_service_mock_mongo:app --port 8001
+
+Чат 1 со 100 сообщениями создаётся при старте, его участник - пользователь 1.
+"""
+import asyncio
+import inspect
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chat_service"))
+from app import mongo  # noqa: E402
+from app.main import app  # noqa: E402
+
+MOCK_MONGO_LATENCY = float(os.getenv("MOCK_MONGO_LATENCY_MS", "0")) / 1000
+MOCK_MONGO_BLOCKING = os.getenv("MOCK_MONGO_BLOCKING", "0") == "1"
+
+
+async def _round_trip() -> None:
+    if MOCK_MONGO_BLOCKING:
+        time.sleep(MOCK_MONGO_LATENCY)
+    else:
+        await asyncio.sleep(MOCK_MONGO_LATENCY)
+
+
+class _WithLatency:
+    """Обёртка над базой/коллекцией/курсором motor: каждый await - один "поход в сеть"."""
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if inspect.iscoroutinefunction(value):
+            async def call(*args, **kwargs):
+                await _round_trip()
+                return await value(*args, **kwargs)
+            return call
+        if callable(value) and name in ("find", "sort", "limit"):
+            return lambda *args, **kwargs: _WithLatency(value(*args, **kwargs))
+        if name in ("chats", "messages", "counters"):
+            return _WithLatency(value)
+        return value
+
+
+async def start() -> None:
+    mongo.client = AsyncMongoMockClient()
+    db = mongo.client[mongo.MONGO_DB]
+    await db.chats.insert_one({
+        "chat_id": 1,
+        "name": "bench",
+        "creator_id": 1,
+        "participants": [1],
+        "created_at": datetime.now(timezone.utc),
+    })
+    await db.messages.insert_many([
+        {"chat_id": 1, "sender_id": 1, "text": f"message {i}", "timestamp": datetime.now(timezone.utc)}
+        for i in range(100)
+    ])
+
+
+async def stop() -> None:
+    mongo.client = None
+
+
+def get_db():
+    db = mongo.client[mongo.MONGO_DB]
+    return _WithLatency(db) if MOCK_MONGO_LATENCY else db
+
+
+mongo.start = start
+mongo.stop = stop
+mongo.get_db = get_db
+
+__all__ = ["app"]
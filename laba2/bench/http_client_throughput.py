@@ -0,0 +1,87 @@
+"""Сравнение клиента httpx на каждый запрос и общего клиента chat_service (app/http_client.py).
+
+Поднимает bench/user_service_stub.py в фоне и гоняет GET /users/{id} в двух режимах.
+Общий клиент создаётся через http_client.start() с настройками пула из USER_SERVICE_*:
+
+    python bench/http_client_throughput.py -n 5000 -c 50
+    USER_SERVICE_MAX_KEEPALIVE=50 python bench/http_client_throughput.py -n 5000 -c 50 --modes shared
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "chat_service"))
+from user_service_stub import app  # noqa: E402
+
+
+def start_stub(port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit(f"stub did not start, is port {port} busy?")
+        time.sleep(0.05)
+    return server
+
+
+async def per_call(base_url, user_id):
+    # Как было до общего пула: новый клиент и новое соединение на каждый запрос
+    async with httpx.AsyncClient() as client:
+        response = await client.get(f"{base_url}/users/{user_id}")
+        response.raise_for_status()
+
+
+async def run(mode, base_url, total, concurrency):
+    from app import http_client
+
+    await http_client.start()
+
+    async def shared_call(user_id):
+        response = await http_client.get_client().get(f"/users/{user_id}")
+        response.raise_for_status()
+
+    call = shared_call if mode == "shared" else lambda uid: per_call(base_url, uid)
+
+    async def worker(offset):
+        for i in range(offset, total, concurrency):
+            await call(i % 10000 + 1)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    print(f"{mode:>8}: {total / elapsed:8.1f} req/s ({elapsed:.2f} s for {total} requests)")
+    if mode == "shared":
+        stats = http_client.pool_stats()
+        print(f"          pool: {stats['connections']} connections, "
+              f"max_connections={stats['max_connections']}, max_keepalive={stats['max_keepalive']}")
+    await http_client.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--requests", type=int, default=5000)
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--modes", default="per-call,shared")
+    args = parser.parse_args()
+
+    server = start_stub(args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    # http_client читает адрес при импорте
+    os.environ["USER_SERVICE_URL"] = base_url
+    for mode in args.modes.split(","):
+        asyncio.run(run(mode, base_url, args.requests, args.concurrency))
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Замер задержки POST /chats/{chat_id}/messages.
+
+Запускать против поднятого docker-compose до и после изменения и сравнивать перцентили:
+
+    python bench/send_message_latency.py --login admin --password secret --chat-id 1 -n 2000 -c 20
+
+Без Postgres и MongoDB - против bench/user_service_stub.py и bench/chat_service_mock_mongo.py
+(см. их описание; STUB_TOKEN_UID=0 и LOGIN_CACHE_SIZE=0 - поиск id по логину на каждый запрос).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def get_token(user_service: str, login: str, password: str) -> str:
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"{user_service}/token",
+            data={"username": login, "password": password}
+        )
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+
+async def worker(client, url, headers, count, latencies, errors):
+    for i in range(count):
+        started = time.perf_counter()
+        response = await client.post(url, json={"text": f"bench {i}"}, headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-service", default="http://localhost:8000")
+    parser.add_argument("--chat-service", default="http://localhost:8001")
+    parser.add_argument("--login", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    token = await get_token(args.user_service, args.login, args.password)
+    headers = {"Authorization": f"Bearer {token}"}
+    url = f"{args.chat_service}/chats/{args.chat_id}/messages"
+
+    latencies, errors = [], []
+    per_worker = args.requests // args.concurrency
+    async with httpx.AsyncClient() as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            worker(client, url, headers, per_worker, latencies, errors)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+    print(f"requests: {len(latencies)}, errors: {len(errors)}, rps: {len(latencies) / elapsed:.1f}")
+    print(f"mean: {statistics.mean(latencies):.2f} ms")
+    for p in (50, 95, 99):
+        print(f"p{p}: {percentile(latencies, p):.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""Заглушка user_service для нагрузочных замеров chat_service без Postgres.
+
+    uvicorn bench.user_service_stub:app --port 8000
+"""
+import os
+from datetime import datetime, timedelta
+
+from typing import List
+
+from fastapi import FastAPI, Form, HTTPException
+from jose import jwt
+from pydantic import BaseModel
+
+app = FastAPI()
+
+USERS = {i: {"id": i, "full_name": f"User {i}"} for i in range(1, 10001)}
+
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
+# STUB_TOKEN_UID=0 - токены без claim uid: chat_service ищет id по логину через /users/by-login
+STUB_TOKEN_UID = os.getenv("STUB_TOKEN_UID", "1") == "1"
+
+
+@app.post("/token")
+def login(username: str = Form(...), password: str = Form(...)):
+    claims = {"sub": username, "exp": datetime.utcnow() + timedelta(minutes=30)}
+    if STUB_TOKEN_UID:
+        claims["uid"] = 1
+    return {"access_token": jwt.encode(claims, SECRET_KEY, algorithm="HS256"), "token_type": "bearer"}
+
+
+class UserLookupRequest(BaseModel):
+    ids: List[int]
+
+
+# Как в user_service: chat_service проверяет участников одним запросом
+@app.post("/users/lookup")
+def lookup_users(lookup: UserLookupRequest):
+    ids = list(dict.fromkeys(lookup.ids))
+    return {
+        "found": [i for i in ids if i in USERS],
+        "missing": [i for i in ids if i not in USERS],
+    }
+
+
+@app.get("/users/{user_id}")
+def read_user(user_id: int):
+    if user_id not in USERS:
+        raise HTTPException(status_code=404, detail="User not found")
+    return USERS[user_id]
+
+
+@app.get("/users/by-login/{login:path}")
+def read_user_by_login(login: str):
+    return USERS[1]
+
+
+@app.get("/.well-known/jwks.json")
+def read_jwks():
+    return {"keys": []}
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+import httpx
+from fastapi import HTTPException, Request
+from jose import JWTError, jwt
+
+from app import http_client
+from app.http_client import USER_SERVICE_URL
+
+# Должны совпадать с настройками create_access_token в user_service.
+# Для RS256/ES256 секрет не нужен: открытые ключи берутся из JWKS user_service.
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+JWKS_URL = os.getenv("JWKS_URL", f"{USER_SERVICE_URL}/.well-known/jwks.json")
+JWKS_DEFAULT_MAX_AGE = 300
+# Не чаще раза в JWKS_MIN_REFRESH секунд перечитываем JWKS из-за неизвестного kid
+JWKS_MIN_REFRESH = int(os.getenv("JWKS_MIN_REFRESH", "30"))
+
+LOGIN_CACHE_SIZE = int(os.getenv("LOGIN_CACHE_SIZE", "10000"))
+LOGIN_CACHE_TTL = int(os.getenv("LOGIN_CACHE_TTL", "600"))
+
+# login -> (user_id, время истечения записи)
+_login_cache: "OrderedDict[str, tuple[int, float]]" = OrderedDict()
+
+# kid -> открытый ключ (JWK), срок годности кэша берётся из Cache-Control
+_jwks_keys = {}
+_jwks_expires_at = 0.0
+_jwks_fetched_at = 0.0
+_jwks_lock = asyncio.Lock()
+
+
+def get_token(request: Request) -> str:
+    auth = request.headers.get("Authorization")
+    if not auth or not auth.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    return auth.split(" ")[1]
+
+
+def _max_age(cache_control: str) -> int:
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    return int(match.group(1)) if match else JWKS_DEFAULT_MAX_AGE
+
+
+async def _refresh_jwks() -> None:
+    global _jwks_keys, _jwks_expires_at, _jwks_fetched_at
+    _jwks_fetched_at = time.monotonic()
+    response = await http_client.get_client().get(JWKS_URL)
+    response.raise_for_status()
+    _jwks_keys = {key["kid"]: key for key in response.json()["keys"]}
+    _jwks_expires_at = time.monotonic() + _max_age(response.headers.get("Cache-Control"))
+
+
+def _jwks_needs_refresh(kid: str) -> bool:
+    now = time.monotonic()
+    if now >= _jwks_expires_at:
+        return True
+    # Неизвестный kid - скорее всего, ключи ротировали: перечитываем JWKS, но с ограничением частоты
+    return kid not in _jwks_keys and now - _jwks_fetched_at >= JWKS_MIN_REFRESH
+
+
+async def get_public_key(kid: str):
+    global _jwks_expires_at
+    if _jwks_needs_refresh(kid):
+        async with _jwks_lock:
+            if _jwks_needs_refresh(kid):
+                try:
+                    await _refresh_jwks()
+                except (httpx.HTTPError, ValueError, KeyError, TypeError):
+                    # user_service недоступен или прислал битый JWKS - продолжаем работать на
+                    # ранее полученных ключах; следующая попытка не раньше чем через JWKS_MIN_REFRESH,
+                    # иначе каждый запрос ждал бы свой таймаут в очереди на _jwks_lock
+                    _jwks_expires_at = time.monotonic() + JWKS_MIN_REFRESH
+                    if not _jwks_keys:
+                        raise HTTPException(status_code=503, detail="Token keys unavailable")
+    return _jwks_keys.get(kid)
+
+
+async def decode_token(token: str) -> dict:
+    try:
+        if ALGORITHM in ASYMMETRIC_ALGORITHMS:
+            key = await get_public_key(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                raise HTTPException(status_code=401, detail="Invalid token")
+        else:
+            key = SECRET_KEY
+        payload = jwt.decode(token, key, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+
+def _cached_user_id(login: str):
+    entry = _login_cache.get(login)
+    if entry is None:
+        return None
+    user_id, expires_at = entry
+    if expires_at < time.monotonic():
+        del _login_cache[login]
+        return None
+    _login_cache.move_to_end(login)
+    return user_id
+
+
+def _remember_user_id(login: str, user_id: int) -> None:
+    _login_cache[login] = (user_id, time.monotonic() + LOGIN_CACHE_TTL)
+    _login_cache.move_to_end(login)
+    while len(_login_cache) > LOGIN_CACHE_SIZE:
+        _login_cache.popitem(last=False)
+
+
+async def resolve_user_id(login: str, token: str) -> int:
+    user_id = _cached_user_id(login)
+    if user_id is not None:
+        return user_id
+
+    response = await http_client.get_client().get(
+        f"/users/by-login/{quote(login, safe='')}",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    if response.status_code in (401, 404):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    response.raise_for_status()
+    user_id = response.json()["id"]
+
+    _remember_user_id(login, user_id)
+    return user_id
+
+
+async def get_current_user(request: Request):
+    # Токен проверяется локально. id берётся из claim uid; для токенов без него
+    # (выданных до появления uid) - из кэша login -> id или из user_service
+    token = get_token(request)
+    payload = await decode_token(token)
+    login = payload["sub"]
+    user_id = payload.get("uid")
+    if user_id is None:
+        user_id = await resolve_user_id(login, token)
+    return {"id": user_id, "login": login}
@@ -0,0 +1,80 @@
+import logging
+import os
+from typing import Optional
+
+import httpx
+
+USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://user_service:8000")
+
+# Настройки пула соединений к user_service
+USER_SERVICE_MAX_CONNECTIONS = int(os.getenv("USER_SERVICE_MAX_CONNECTIONS", "100"))
+USER_SERVICE_MAX_KEEPALIVE = int(os.getenv("USER_SERVICE_MAX_KEEPALIVE", "20"))
+USER_SERVICE_KEEPALIVE_EXPIRY = float(os.getenv("USER_SERVICE_KEEPALIVE_EXPIRY", "30"))
+USER_SERVICE_TIMEOUT = float(os.getenv("USER_SERVICE_TIMEOUT", "5"))
+USER_SERVICE_CONNECT_TIMEOUT = float(os.getenv("USER_SERVICE_CONNECT_TIMEOUT", "2"))
+# HTTP/2 требует пакет h2 (pip install "httpx[http2]") и сервер/прокси с поддержкой h2
+USER_SERVICE_HTTP2 = os.getenv("USER_SERVICE_HTTP2", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+client: Optional[httpx.AsyncClient] = None
+requests_total = 0
+
+
+async def _count_request(request: httpx.Request) -> None:
+    global requests_total
+    requests_total += 1
+
+
+def create_client() -> httpx.AsyncClient:
+    http2 = USER_SERVICE_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("USER_SERVICE_HTTP2=1, but h2 is not installed - falling back to HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        base_url=USER_SERVICE_URL,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=USER_SERVICE_MAX_CONNECTIONS,
+            max_keepalive_connections=USER_SERVICE_MAX_KEEPALIVE,
+            keepalive_expiry=USER_SERVICE_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(USER_SERVICE_TIMEOUT, connect=USER_SERVICE_CONNECT_TIMEOUT),
+        event_hooks={"request": [_count_request]},
+    )
+
+
+async def start() -> None:
+    global client
+    client = create_client()
+
+
+async def stop() -> None:
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    if client is None:
+        raise RuntimeError("HTTP client is not started, check the app lifespan")
+    return client
+
+
+def pool_stats() -> dict:
+    connections = get_client()._transport._pool.connections
+    idle = sum(1 for c in connections if c.is_idle())
+    http2 = sum(1 for c in connections if "HTTP/2" in c.info())
+    return {
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "http2": http2,
+        "max_connections": USER_SERVICE_MAX_CONNECTIONS,
+        "max_keepalive": USER_SERVICE_MAX_KEEPALIVE,
+        "requests_total": requests_total,
+    }
@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+from pymongo import DESCENDING, ReturnDocument
+
+# 1 - каждый id выдаётся отдельным $inc в MongoDB.
+# N > 1 - hi/lo: воркер резервирует сразу N id и раздаёт их из памяти
+# (после перезапуска неиспользованный остаток блока пропадает, в нумерации будут дыры).
+CHAT_ID_BLOCK_SIZE = int(os.getenv("CHAT_ID_BLOCK_SIZE", "1"))
+
+
+class SequenceAllocator:
+    """Последовательность id на документе коллекции counters: {_id: name, seq: последний выданный id}."""
+
+    def __init__(self, name: str, block_size: int = 1):
+        self.name = name
+        self.block_size = max(1, block_size)
+        self._next = 1
+        self._last = 0
+        self._lock = asyncio.Lock()
+
+    async def _reserve(self, db, count: int) -> int:
+        counter = await db.counters.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["seq"]
+
+    async def ensure_at_least(self, db, value: int) -> None:
+        # Не даём счётчику отстать от уже существующих документов
+        await db.counters.update_one({"_id": self.name}, {"$max": {"seq": value}}, upsert=True)
+
+    async def next_id(self, db) -> int:
+        if self.block_size == 1:
+            return await self._reserve(db, 1)
+        async with self._lock:
+            if self._next > self._last:
+                self._last = await self._reserve(db, self.block_size)
+                self._next = self._last - self.block_size + 1
+            value = self._next
+            self._next += 1
+            return value
+
+
+chat_ids = SequenceAllocator("chat_id", CHAT_ID_BLOCK_SIZE)
+
+
+async def init(db) -> None:
+    last_chat = await db.chats.find_one({}, {"chat_id": 1}, sort=[("chat_id", DESCENDING)])
+    if last_chat is not None:
+        await chat_ids.ensure_at_least(db, last_chat["chat_id"])
@@ -0,0 +1,50 @@
+import base64
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(message: dict) -> str:
+    # Курсор - позиция сообщения (timestamp, _id); MongoDB хранит время с точностью до миллисекунд
+    millis = (message["timestamp"].replace(tzinfo=None) - EPOCH) // timedelta(milliseconds=1)
+    raw = f"{millis}:{message['_id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        millis, oid = raw.split(":")
+        return EPOCH + timedelta(milliseconds=int(millis)), ObjectId(oid)
+    except (ValueError, OverflowError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(chat_id: int, before: str = None, after: str = None):
+    """Фильтр и сортировка страницы: before - сообщения старше курсора, after - новее.
+
+    Условие по (timestamp, _id) идёт по индексу {chat_id: 1, timestamp: -1, _id: -1},
+    поэтому страница стоит одинаково независимо от глубины.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    query = {"chat_id": chat_id}
+    if after:
+        timestamp, oid = decode_cursor(after)
+        query["$or"] = [
+            {"timestamp": {"$gt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$gt": oid}},
+        ]
+        return query, [("timestamp", ASCENDING), ("_id", ASCENDING)]
+    if before:
+        timestamp, oid = decode_cursor(before)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": oid}},
+        ]
+    return query, [("timestamp", DESCENDING), ("_id", DESCENDING)]
@@ -3,11 +3,12 @@ db = db.getSiblingDB('chatdb');
 // Создание коллекций
 db.createCollection('chats');
 db.createCollection('messages');
+db.createCollection('counters');
 
 // Создание индексов
 db.chats.createIndex({ "chat_id": 1 }, { unique: true });
 db.chats.createIndex({ "participants": 1 });
-db.messages.createIndex({ "chat_id": 1, "timestamp": -1 });
+db.messages.createIndex({ "chat_id": 1, "timestamp": -1, "_id": -1 });
 
 // Тестовые данные
 db.chats.insertOne({
@@ -18,6 +19,9 @@ db.chats.insertOne({
     created_at: new Date()
 });
 
+// Последний выданный chat_id (см. app/ids.py)
+db.counters.insertOne({ _id: "chat_id", seq: 1 });
+
 db.messages.insertOne({
     chat_id: 1,
     sender_id: 1,
@@ -0,0 +1,142 @@
+from datetime import timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import cache, hashing, users_crud
+from app.auth import ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token, get_current_user
+from app.codecs import FastJSONResponse
+from app.models import (User, UserCreate, UserLookupRequest, UserLookupResponse, UserResponse,
+                        get_async_db)
+
+# Маршруты для DB_MODE=async: /token, /register, чтения и PUT/DELETE /users/{id} идут через
+# asyncpg. Подключаются в main.py раньше sync-версий с теми же путями и перекрывают их.
+# /userscache остаются sync в обоих режимах: слой кэша (Redis-клиент, single-flight на потоках)
+# синхронный, поэтому при сравнении режимов эти маршруты не показательны.
+# Хуки кэша после записи - короткие вызовы Redis, они уходят в пул потоков.
+router = APIRouter()
+
+_credentials_error = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Incorrect username or password",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+@router.post("/token")
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(),
+                                 db: AsyncSession = Depends(get_async_db)):
+    user = await users_crud.get_user_by_login_async(db, form_data.username)
+    if not user:
+        raise _credentials_error
+    verified, new_hash = await hashing.verify_and_update(form_data.password, user.password_hash)
+    if not verified:
+        raise _credentials_error
+    if new_hash is not None:
+        await users_crud.update_password_hash_async(db, user.id, new_hash)
+    access_token = create_access_token(
+        data={"sub": user.login, "uid": user.id},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.post("/register", response_model=UserResponse)
+async def register_user(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    hashed_password = await hashing.hash_password(user_data.password)
+    try:
+        new_user = await users_crud.insert_user_async(db, user_data.login, user_data.full_name,
+                                                      user_data.email, hashed_password)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid user data")
+    if new_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User with this login already exists"
+        )
+    await run_in_threadpool(cache.user_created, new_user)
+    return FastJSONResponse(new_user._asdict())
+
+
+@router.get("/users", response_model=List[UserResponse])
+async def read_users(request: Request,
+                     skip: int = 0, limit: int = 100, after_id: Optional[int] = None,
+                     current_user: User = Depends(get_current_user),
+                     db: AsyncSession = Depends(get_async_db)):
+    if after_id is None:
+        return FastJSONResponse(await users_crud.get_user_rows_async(db, skip, limit))
+    users = await users_crud.get_users_after_async(db, after_id, limit)
+    headers = {}
+    if len(users) == limit:
+        next_url = request.url.remove_query_params("skip").include_query_params(after_id=users[-1]["id"])
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return FastJSONResponse(users, headers=headers)
+
+
+@router.post("/users/lookup", response_model=UserLookupResponse)
+async def lookup_users(lookup: UserLookupRequest,
+                       current_user: User = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_async_db)):
+    ids = list(dict.fromkeys(lookup.ids))
+    candidates = [i for i in ids if cache.user_ids.might_contain(i)]
+    existing = await users_crud.get_existing_ids_async(db, candidates) if candidates else set()
+    return {
+        "found": [i for i in ids if i in existing],
+        "missing": [i for i in ids if i not in existing],
+    }
+
+
+@router.get("/users/by-login/{login:path}", response_model=UserResponse)
+async def read_user_by_login(login: str,
+                             current_user: User = Depends(get_current_user),
+                             db: AsyncSession = Depends(get_async_db)):
+    db_user = await users_crud.get_user_row_by_login_async(db, login)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return FastJSONResponse(db_user)
+
+
+# :int - чтобы не перехватывать /users/export и другие пути из main.py
+@router.get("/users/{user_id:int}", response_model=UserResponse)
+async def read_user(user_id: int,
+                    current_user: User = Depends(get_current_user),
+                    db: AsyncSession = Depends(get_async_db)):
+    db_user = await users_crud.get_user_row_async(db, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return FastJSONResponse(db_user)
+
+
+@router.put("/users/{user_id:int}", response_model=UserResponse)
+async def update_user(user_id: int, updated_data: UserCreate,
+                      current_user: User = Depends(get_current_user),
+                      db: AsyncSession = Depends(get_async_db)):
+    try:
+        db_user = await users_crud.update_user_async(db, user_id, updated_data.login,
+                                                     updated_data.full_name, updated_data.email)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User with this login already exists"
+        )
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    await run_in_threadpool(cache.user_updated, db_user)
+    return FastJSONResponse(db_user._asdict())
+
+
+@router.delete("/users/{user_id:int}", response_model=UserResponse)
+async def delete_user(user_id: int,
+                      current_user: User = Depends(get_current_user),
+                      db: AsyncSession = Depends(get_async_db)):
+    db_user = await users_crud.delete_user_async(db, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    await run_in_threadpool(cache.user_deleted, user_id)
+    return FastJSONResponse(db_user._asdict())
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwk, jwt
+
+# HS256 - общий секрет (как раньше), RS256/ES256 - подпись закрытым ключом,
+# открытые ключи публикуются в /.well-known/jwks.json
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# Каталог с закрытыми ключами <kid>.pem. Все ключи из каталога публикуются в JWKS,
+# подписывает только JWT_ACTIVE_KID - так старый ключ можно держать до истечения его токенов.
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR", "/app/keys")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID")
+JWKS_MAX_AGE = int(os.getenv("JWKS_MAX_AGE", "300"))
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+# kid -> закрытый ключ в PEM
+private_keys = {}
+# kid -> открытый ключ в формате JWK
+public_keys = {}
+
+
+def load_keys():
+    if ALGORITHM not in ASYMMETRIC_ALGORITHMS:
+        return
+    if not os.path.isdir(JWT_KEYS_DIR):
+        raise RuntimeError(f"JWT_ALGORITHM={ALGORITHM} requires keys in {JWT_KEYS_DIR}")
+    for filename in sorted(os.listdir(JWT_KEYS_DIR)):
+        if not filename.endswith(".pem"):
+            continue
+        kid = filename[:-len(".pem")]
+        with open(os.path.join(JWT_KEYS_DIR, filename)) as f:
+            pem = f.read()
+        public_key = jwk.construct(pem, ALGORITHM).public_key().to_dict()
+        public_key.update({"kid": kid, "use": "sig"})
+        private_keys[kid] = pem
+        public_keys[kid] = public_key
+    if not private_keys:
+        raise RuntimeError(f"No *.pem keys found in {JWT_KEYS_DIR}")
+    if JWT_ACTIVE_KID is not None and JWT_ACTIVE_KID not in private_keys:
+        raise RuntimeError(f"Active key {JWT_ACTIVE_KID} not found in {JWT_KEYS_DIR}")
+
+
+def active_kid():
+    # По умолчанию подписываем последним по имени ключом (например, 2025-04.pem)
+    return JWT_ACTIVE_KID or max(private_keys)
+
+
+def get_jwks():
+    return {"keys": list(public_keys.values())}
+
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=15)
+    to_encode.update({"exp": expire})
+    if ALGORITHM in ASYMMETRIC_ALGORITHMS:
+        kid = active_kid()
+        return jwt.encode(to_encode, private_keys[kid], algorithm=ALGORITHM, headers={"kid": kid})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_token(token: str) -> dict:
+    if ALGORITHM in ASYMMETRIC_ALGORITHMS:
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid not in public_keys:
+            raise JWTError("Unknown key id")
+        return jwt.decode(token, public_keys[kid], algorithms=[ALGORITHM])
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+
+class TokenCache:
+    """LRU уже проверенных токенов: sha256(token) -> (payload, exp).
+
+    Запись живёт не дольше exp самого токена, поэтому повторные запросы
+    того же клиента не проверяют подпись заново.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        payload, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        expires_at = payload.get("exp")
+        if expires_at is None or self.maxsize <= 0:
+            return
+        self._entries[self._key(token)] = (payload, expires_at)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = decode_token(token)
+            token_cache.put(token, payload)
+        username: str = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+        else:
+            return username
+    except JWTError:
+        raise credentials_exception
+
+
+def generate_key(kid: str):
+    # python -m app.auth <kid> - создать новый ключ для ротации
+    path = os.path.join(JWT_KEYS_DIR, f"{kid}.pem")
+    if ALGORITHM == "ES256":
+        import ecdsa
+        pem = ecdsa.SigningKey.generate(curve=ecdsa.NIST256p).to_pem().decode()
+    elif ALGORITHM == "RS256":
+        import rsa
+        _, private_key = rsa.newkeys(2048)
+        pem = private_key.save_pkcs1().decode()
+    else:
+        raise SystemExit(f"Set JWT_ALGORITHM to one of {ASYMMETRIC_ALGORITHMS}")
+    os.makedirs(JWT_KEYS_DIR, exist_ok=True)
+    with open(path, "w") as f:
+        f.write(pem)
+    print(path)
+
+
+if __name__ == "__main__":
+    generate_key(sys.argv[1])
+else:
+    load_keys()
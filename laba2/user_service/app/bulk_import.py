@@ -0,0 +1,320 @@
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from anyio import from_thread
+from fastapi.concurrency import run_in_threadpool
+
+from app import cache, hashing
+
+# Массовая загрузка пользователей: NDJSON или CSV -> хэширование паролей в пуле процессов ->
+# COPY FROM STDIN во временную таблицу -> один INSERT ... ON CONFLICT на пачку.
+# CLI: python -m app.bulk_import users.ndjson [--format csv]
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", str(os.cpu_count() or 1)))
+IMPORT_HASH_BATCH = 50
+# Сколько ошибок по строкам возвращать в отчёте (счётчик failed считает все)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+# Импорт в процессе один за раз; второй получает 503 с этим Retry-After, с
+IMPORT_RETRY_AFTER = int(os.getenv("IMPORT_RETRY_AFTER", "30"))
+
+COLUMNS = ("login", "password_hash", "full_name", "email")
+# Размеры колонок users: более длинное значение отклонила бы база, и с ним - всю пачку
+MAX_LENGTHS = {"login": 50, "password_hash": 128, "full_name": 100, "email": 100}
+
+CREATE_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS users_import (
+        line integer, login text, password_hash text, full_name text, email text
+    ) ON COMMIT DELETE ROWS
+"""
+COPY_STAGING = "COPY users_import (line, login, password_hash, full_name, email) FROM STDIN WITH (FORMAT csv)"
+# Из повторов логина внутри файла берём первую строку, занятые логины пропускаем
+INSERT_FROM_STAGING = """
+    INSERT INTO users (login, password_hash, full_name, email, created_at)
+    SELECT DISTINCT ON (login) login, password_hash, full_name, email, now()
+    FROM users_import
+    ORDER BY login, line
+    ON CONFLICT (login) DO NOTHING
+    RETURNING id, login
+"""
+
+
+class ImportBusy(Exception):
+    pass
+
+
+def iter_records(lines, fmt: str):
+    """Строки входа (с переводом строки на конце) -> (номер строки, запись, ошибка).
+
+    Для CSV первая запись - заголовок; поле в кавычках может занимать несколько строк,
+    номер - строка, с которой запись начинается.
+    """
+    if fmt == "csv":
+        reader = csv.reader(lines)
+        header = None
+        while True:
+            line = reader.line_num + 1
+            try:
+                values = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as exc:
+                yield line, None, f"invalid CSV: {exc}"
+                continue
+            if not values:
+                continue
+            if header is None:
+                header = [name.strip() for name in values]
+            elif len(values) != len(header):
+                yield line, None, f"expected {len(header)} columns, got {len(values)}"
+            else:
+                yield line, dict(zip(header, values)), None
+        return
+    for line, text in enumerate(lines, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as exc:
+            yield line, None, f"invalid JSON: {exc}"
+            continue
+        if not isinstance(record, dict):
+            yield line, None, "expected a JSON object"
+            continue
+        yield line, record, None
+
+
+def validate(record: dict):
+    for field in ("login", "password", "password_hash", "full_name", "email"):
+        value = record.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            return f"{field} must be a string"
+        # Вход декодируется с surrogateescape: битые байты UTF-8 доходят сюда суррогатами
+        try:
+            value.encode("utf-8")
+        except UnicodeEncodeError:
+            return f"{field} is not valid UTF-8"
+        # NUL не принимают ни Postgres в тексте, ни bcrypt в пароле
+        if "\x00" in value:
+            return f"{field} must not contain NUL characters"
+    if not record.get("login"):
+        return "login is required"
+    # password_hash - уже готовый хэш (миграция из другой системы), password - открытый пароль
+    if record.get("password_hash"):
+        if hashing.pwd_context.identify(record["password_hash"]) is None:
+            return "unsupported password_hash format"
+    elif not record.get("password"):
+        return "password or password_hash is required"
+    for field, limit in MAX_LENGTHS.items():
+        if len(record.get(field) or "") > limit:
+            return f"{field} is longer than {limit} characters"
+    return None
+
+
+class Importer:
+    def __init__(self, engine, executor: ProcessPoolExecutor):
+        self.engine = engine
+        self.executor = executor
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.monotonic()
+        # id закоммиченных строк, о которых ещё не знают кэши воркеров
+        self.unannounced = []
+
+    def error(self, line: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def _hash_passwords(self, chunk) -> None:
+        pending = [record for _, record in chunk if not record.get("password_hash")]
+        batches = [pending[i:i + IMPORT_HASH_BATCH] for i in range(0, len(pending), IMPORT_HASH_BATCH)]
+        passwords = ([record["password"] for record in batch] for batch in batches)
+        for batch, hashes in zip(batches, self.executor.map(hashing.hash_many, passwords)):
+            for record, password_hash in zip(batch, hashes):
+                record["password_hash"] = password_hash
+
+    @staticmethod
+    def _insert(connection, rows) -> dict:
+        """COPY во временную таблицу и INSERT в users одной транзакцией; {login: id} вставленных."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for line, record in rows:
+            writer.writerow([line] + [record.get(column) for column in COLUMNS])
+        buffer.seek(0)
+        cursor = connection.cursor()
+        cursor.execute(CREATE_STAGING)
+        cursor.copy_expert(COPY_STAGING, buffer)
+        cursor.execute(INSERT_FROM_STAGING)
+        inserted = {login: user_id for user_id, login in cursor.fetchall()}
+        connection.commit()
+        return inserted
+
+    def load_chunk(self, chunk) -> None:
+        """chunk - [(номер строки, запись)], уже прошедшие validate()."""
+        if not chunk:
+            return
+        self._hash_passwords(chunk)
+        dbapi = self.engine.dialect.dbapi
+        rejected = set()
+        connection = self.engine.raw_connection()
+        try:
+            try:
+                inserted = self._insert(connection, chunk)
+            except (dbapi.DataError, dbapi.IntegrityError):
+                # Пачку отклонила база - повторяем по одной строке, чтобы найти виноватые
+                connection.rollback()
+                inserted = {}
+                for line, record in chunk:
+                    try:
+                        inserted.update(self._insert(connection, [(line, record)]))
+                    except (dbapi.DataError, dbapi.IntegrityError) as exc:
+                        connection.rollback()
+                        rejected.add(line)
+                        self.error(line, f"rejected by database: {str(exc).splitlines()[0]}")
+        finally:
+            connection.close()
+        self.unannounced.extend(inserted.values())
+
+        first_line = {}
+        for line, record in chunk:
+            if line not in rejected:
+                first_line.setdefault(record["login"], line)
+        for line, record in chunk:
+            if line in rejected:
+                continue
+            if record["login"] not in inserted:
+                self.error(line, "User with this login already exists")
+            elif first_line[record["login"]] != line:
+                self.error(line, f"duplicate login, first seen on line {first_line[record['login']]}")
+            else:
+                self.inserted += 1
+
+    def announce(self) -> None:
+        # После каждой пачки, а не в конце: упавший на середине импорт уже что-то закоммитил
+        if self.unannounced:
+            cache.users_imported(self.unannounced)
+            self.unannounced = []
+
+    def run(self, lines, fmt: str, progress=None) -> None:
+        chunk = []
+        try:
+            for line, record, error in iter_records(lines, fmt):
+                if error is None:
+                    error = validate(record)
+                if error is not None:
+                    self.error(line, error)
+                    continue
+                chunk.append((line, record))
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    self.load_chunk(chunk)
+                    chunk = []
+                    self.announce()
+                    if progress is not None:
+                        progress(line, self)
+            self.load_chunk(chunk)
+        finally:
+            self.announce()
+
+    def report(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "seconds": round(time.monotonic() - self.started, 3),
+            "errors": self.errors,
+        }
+
+
+# Отдельный пул: импорт не должен занимать пул хэширования, который обслуживает /token.
+# Создаётся при первом импорте и живёт до stop(); импорты идут по одному
+_executor: Optional[ProcessPoolExecutor] = None
+_running = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMPORT_HASH_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def stop() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def import_lines(engine, lines, fmt: str, progress=None) -> dict:
+    if not _running.acquire(blocking=False):
+        raise ImportBusy()
+    try:
+        importer = Importer(engine, _get_executor())
+        importer.run(lines, fmt, progress)
+        return importer.report()
+    finally:
+        _running.release()
+
+
+def _print_progress(line: int, importer: Importer) -> None:
+    print(f"{line} lines, {importer.inserted} inserted, {importer.failed} failed", file=sys.stderr)
+
+
+def import_file(engine, path: str, fmt: str) -> dict:
+    # newline="" - переводы строк внутри полей CSV в кавычках сохраняются как есть
+    with open(path, encoding="utf-8", errors="surrogateescape", newline="") as source:
+        return import_lines(engine, source, fmt, _print_progress)
+
+
+async def iter_lines(chunks):
+    # Тело запроса приходит кусками произвольной длины - режем на строки.
+    # Битый UTF-8 не роняет запрос: validate() вернёт ошибку для этой строки
+    buffer = b""
+    async for data in chunks:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield (line + b"\n").decode("utf-8", "surrogateescape")
+    if buffer:
+        yield buffer.decode("utf-8", "surrogateescape")
+
+
+def _lines_from_loop(lines):
+    # Синхронный итератор для потока пула: каждую строку берёт из event loop
+    while True:
+        try:
+            yield from_thread.run(lines.__anext__)
+        except StopAsyncIteration:
+            return
+
+
+async def import_stream(engine, chunks, fmt: str) -> dict:
+    # Для эндпоинта: разбор, хэширование и COPY - в пуле потоков, тело запроса читает event loop
+    return await run_in_threadpool(import_lines, engine, _lines_from_loop(iter_lines(chunks)), fmt)
+
+
+if __name__ == "__main__":
+    from app.models import engine
+
+    arg_parser = argparse.ArgumentParser(description="Массовая загрузка пользователей из NDJSON или CSV")
+    arg_parser.add_argument("path")
+    arg_parser.add_argument("--format", choices=["ndjson", "csv"], default=None,
+                            help="по умолчанию - по расширению файла")
+    args = arg_parser.parse_args()
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    try:
+        print(json.dumps(import_file(engine, args.path, fmt), ensure_ascii=False, indent=2))
+    finally:
+        stop()
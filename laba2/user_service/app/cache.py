@@ -1,7 +1,577 @@
 import os
+import hashlib
+import inspect
+import logging
+import math
+import random
+import threading
+import time
+import uuid
 import redis
-import json
+from collections import OrderedDict, defaultdict
 from functools import wraps
 
+from app.codecs import CODECS, DEFAULT_CODEC, RESPONSE_CODEC
+
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
\ No newline at end of file
+# Значения хранятся в байтах: кодек (json/orjson/msgpack) выбирается политикой кэша
+redis_client = redis.from_url(REDIS_URL)
+logger = logging.getLogger(__name__)
+
+# Заполнение кэша при промахе (single-flight):
+# - в пределах процесса значение пересобирает один поток, остальные ждут его результат;
+# - между воркерами - тот, кто взял короткую блокировку lock:{key} в Redis.
+# Пока идёт пересборка, остальные получают устаревшую копию, если она есть.
+CACHE_FILL_LOCK_TTL_MS = int(os.getenv("CACHE_FILL_LOCK_TTL_MS", "5000"))
+CACHE_FILL_WAIT_TIMEOUT = float(os.getenv("CACHE_FILL_WAIT_TIMEOUT", "2"))
+CACHE_FILL_POLL_INTERVAL = 0.02
+# Сколько устаревшая копия хранится в Redis после логического истечения
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "60"))
+# Версия ключа ver:{key} растёт при каждой записи (invalidate). Заполнение при промахе
+# пишет в Redis, только если версия не изменилась с момента до чтения из базы: иначе
+# значение, прочитанное до commit, перетёрло бы новое на весь TTL. Версия должна
+# жить дольше любого заполнения.
+CACHE_VERSION_TTL = int(os.getenv("CACHE_VERSION_TTL", "3600"))
+# Вероятностное раннее истечение (XFetch): чем дороже пересборка и ближе срок,
+# тем вероятнее запрос обновит значение заранее. 0 - отключить.
+CACHE_EARLY_EXPIRY_BETA = float(os.getenv("CACHE_EARLY_EXPIRY_BETA", "1.0"))
+
+# L1 - кэш в памяти воркера перед Redis. Согласованность держится через канал
+# CACHE_INVALIDATION_CHANNEL: пути записи публикуют туда изменённые ключи.
+# Пока воркер не подписан на канал, L1 выключен. 0 - не использовать L1.
+CACHE_L1_MAX_SIZE = int(os.getenv("CACHE_L1_MAX_SIZE", "10000"))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "30"))
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Bloom-фильтр id существующих пользователей: id, которых в фильтре точно нет,
+# получают 404 без обращения к Redis и Postgres. Новые id рассылаются всем воркерам
+# через USER_BLOOM_CHANNEL; пока фильтр не построен или воркер не подписан, он не используется.
+USER_BLOOM_FILTER = os.getenv("USER_BLOOM_FILTER", "0") == "1"
+USER_BLOOM_CAPACITY = int(os.getenv("USER_BLOOM_CAPACITY", "1000000"))
+USER_BLOOM_ERROR_RATE = float(os.getenv("USER_BLOOM_ERROR_RATE", "0.01"))
+USER_BLOOM_CHANNEL = "users:bloom"
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# KEYS: ключ, ver:{ключ}; ARGV: версия, прочитанная до загрузки ('' - не было), значение, TTL
+_STORE_IF_UNCHANGED_SCRIPT = """
+if (redis.call('get', KEYS[2]) or '') == ARGV[1] then
+    redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class CachePolicy:
+    """Как кэшируется одно пространство ключей.
+
+    key_template подставляется аргументами кэшируемой функции: CachePolicy("user", "{user_id}")
+    даёт ключи user:42. negative_ttl > 0 включает кэширование отсутствующих значений
+    (функция вернула None, то есть 404). jitter разносит истечение ключей, записанных одновременно.
+    """
+
+    def __init__(self, namespace: str, key_template: str, ttl: int, negative_ttl: int = 0,
+                 jitter: float = 0.1, codec: str = DEFAULT_CODEC):
+        self.namespace = namespace
+        self.key_template = key_template
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.jitter = jitter
+        self.codec = CODECS[codec]
+
+    def key(self, **params) -> str:
+        return f"{self.namespace}:{self.key_template.format(**params)}"
+
+    def ttl_for(self, value) -> int:
+        ttl = self.ttl if value is not None else self.negative_ttl
+        return max(1, round(ttl * random.uniform(1 - self.jitter, 1 + self.jitter)))
+
+
+class CacheMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(int))
+
+    def record(self, namespace: str, outcome: str, seconds: float) -> None:
+        with self._lock:
+            counters = self._counters[namespace]
+            counters[outcome] += 1
+            counters["requests"] += 1
+            counters["seconds_total"] += seconds
+
+    def record_fill(self, namespace: str, seconds: float) -> None:
+        with self._lock:
+            counters = self._counters[namespace]
+            counters["fills"] += 1
+            counters["fill_seconds_total"] += seconds
+
+    def snapshot(self) -> dict:
+        # outcome: l1_hit, hit, negative_hit, stale_hit, miss
+        with self._lock:
+            result = {}
+            for namespace, counters in self._counters.items():
+                stats = dict(counters)
+                requests = stats["requests"]
+                hits = stats.get("l1_hit", 0) + stats.get("hit", 0) + stats.get("negative_hit", 0)
+                stats["hit_ratio"] = hits / requests if requests else 0.0
+                stats["avg_ms"] = stats["seconds_total"] / requests * 1000 if requests else 0.0
+                result[namespace] = stats
+            return result
+
+
+metrics = CacheMetrics()
+
+
+class LocalCache:
+    """Ограниченный по размеру LRU с TTL: key -> (запись из Redis, срок жизни в L1)."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = False
+        # Растёт при каждой инвалидации: значение, прочитанное из Redis до неё, в L1 не кладём
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: dict, version: int) -> None:
+        if not self.enabled or self.maxsize <= 0:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (entry, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+l1 = LocalCache(CACHE_L1_MAX_SIZE, CACHE_L1_TTL)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class UserIdFilter:
+    """Bloom-фильтр id пользователей; loader - функция, возвращающая все id из базы."""
+
+    def __init__(self):
+        self.loader = None
+        self.ready = False
+        self._filter = None
+        self._pending = None
+        self._lock = threading.Lock()
+        # Перестройки идут по одной: иначе они делят _pending и последней победит любая
+        self._rebuild_lock = threading.RLock()
+        self._rebuild_queued = False
+
+    def rebuild(self) -> None:
+        if self.loader is None:
+            return
+        with self._rebuild_lock:
+            with self._lock:
+                # id, добавленные пока читаем базу, докинем в новый фильтр после чтения
+                self._pending = set()
+            try:
+                bloom = BloomFilter(USER_BLOOM_CAPACITY, USER_BLOOM_ERROR_RATE)
+                for user_id in self.loader():
+                    bloom.add(user_id)
+            except Exception:
+                # Фильтр без части id дал бы ложные 404 - не используем его до следующей перестройки
+                logger.exception("User id filter rebuild failed")
+                with self._lock:
+                    self._pending = None
+                    self.ready = False
+                return
+            with self._lock:
+                for user_id in self._pending:
+                    bloom.add(user_id)
+                self._pending = None
+                self._filter = bloom
+                self.ready = True
+
+    def rebuild_in_background(self) -> None:
+        # Пока одна перестройка ждёт своей очереди, новые запросы к ней присоединяются:
+        # она и так прочитает базу после них
+        with self._lock:
+            if self._rebuild_queued:
+                return
+            self._rebuild_queued = True
+        threading.Thread(target=self._queued_rebuild, name="user-ids-rebuild", daemon=True).start()
+
+    def _queued_rebuild(self) -> None:
+        with self._rebuild_lock:
+            with self._lock:
+                self._rebuild_queued = False
+            self.rebuild()
+
+    def add(self, user_id: int) -> None:
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(user_id)
+            if self._pending is not None:
+                self._pending.add(user_id)
+
+    def might_contain(self, user_id: int) -> bool:
+        if not self.ready:
+            return True
+        return user_id in self._filter
+
+
+user_ids = UserIdFilter()
+
+
+def _listen_invalidations() -> None:
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CACHE_INVALIDATION_CHANNEL, USER_BLOOM_CHANNEL)
+            # Пока не были подписаны, инвалидации и новые id могли пройти мимо
+            l1.clear()
+            l1.enabled = True
+            if USER_BLOOM_FILTER:
+                # В фоне: пока читаем все id из базы, инвалидации L1 должны обрабатываться
+                user_ids.rebuild_in_background()
+            for message in pubsub.listen():
+                if message["channel"] == USER_BLOOM_CHANNEL.encode():
+                    user_ids.add(int(message["data"]))
+                else:
+                    l1.delete(message["data"].decode())
+        except Exception as exc:
+            # Поток не должен умереть: без подписчика l1 отдавал бы устаревшие значения
+            if not isinstance(exc, redis.RedisError):
+                logger.exception("Cache invalidation listener failed")
+            l1.enabled = False
+            l1.clear()
+            user_ids.ready = False
+            time.sleep(1)
+
+def start_invalidation_listener() -> None:
+    if CACHE_L1_MAX_SIZE > 0 or USER_BLOOM_FILTER:
+        threading.Thread(target=_listen_invalidations, name="cache-invalidation", daemon=True).start()
+
+def invalidate(key: str, pipe=None) -> None:
+    # Ключ удаляется у всех воркеров (включая текущий) через канал инвалидации;
+    # новая версия не даёт идущему сейчас заполнению записать значение, прочитанное до commit
+    l1.delete(key)
+    target = pipe or redis_client.pipeline()
+    target.incr(version_key(key))
+    target.expire(version_key(key), CACHE_VERSION_TTL)
+    target.publish(CACHE_INVALIDATION_CHANNEL, key)
+    if pipe is None:
+        target.execute()
+
+
+class Entry:
+    """Запись кэша: закодированное значение (payload) + метаданные для раннего истечения.
+
+    В Redis хранится как b"<кодек>:<срок годности>:<время пересборки>:" + payload, поэтому
+    payload JSON-кодека можно отдать клиенту как тело ответа без разбора.
+    Пустой payload - отметка об отсутствии значения (404).
+    """
+
+    __slots__ = ("payload", "delta", "expires_at", "_value")
+
+    _UNSET = object()
+
+    def __init__(self, payload: bytes, delta: float, expires_at: float):
+        self.payload = payload
+        self.delta = delta
+        self.expires_at = expires_at
+        self._value = self._UNSET
+
+    @classmethod
+    def parse(cls, raw: bytes, codec) -> "Entry":
+        # Запись другим кодеком (после смены CACHE_CODEC) считаем промахом
+        codec_name, expires_at, delta, payload = raw.split(b":", 3)
+        if codec_name.decode() != codec.name:
+            return None
+        return cls(payload, float(delta), float(expires_at))
+
+    def dump(self, codec) -> bytes:
+        return b"%s:%.3f:%.6f:" % (codec.name.encode(), self.expires_at, self.delta) + self.payload
+
+    @property
+    def missing(self) -> bool:
+        return not self.payload
+
+    def value(self, codec):
+        if self._value is self._UNSET:
+            self._value = codec.loads(self.payload) if self.payload else None
+        return self._value
+
+    def is_expired(self) -> bool:
+        early = -self.delta * CACHE_EARLY_EXPIRY_BETA * math.log(1.0 - random.random())
+        return time.time() + early >= self.expires_at
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _encode(policy: "CachePolicy", value, delta: float = 0.0) -> Entry:
+    payload = policy.codec.dumps(value) if value is not None else b""
+    return Entry(payload, delta, time.time() + policy.ttl_for(value))
+
+def version_key(key: str) -> str:
+    return f"ver:{key}"
+
+def _redis_ttl(entry: Entry) -> int:
+    return max(1, round(entry.expires_at - time.time())) + CACHE_STALE_TTL
+
+def store(policy: CachePolicy, key: str, value, delta: float = 0.0, pipe=None):
+    """Записать значение в Redis; None записывается как отметка об отсутствии (если включено)."""
+    entry = _encode(policy, value, delta)
+    if value is None and policy.negative_ttl <= 0:
+        return entry
+    (pipe or redis_client).set(key, entry.dump(policy.codec), ex=_redis_ttl(entry))
+    return entry
+
+def _fill(policy: CachePolicy, key: str, loader, stale: Entry) -> Entry:
+    lock_key = f"lock:{key}"
+    token = uuid.uuid4().hex
+    if redis_client.set(lock_key, token, nx=True, px=CACHE_FILL_LOCK_TTL_MS):
+        try:
+            version = l1.version
+            # Читаем до loader(): запись, закоммиченная после чтения из базы, сменит версию
+            redis_version = redis_client.get(version_key(key)) or b""
+            started = time.perf_counter()
+            value = loader()
+            delta = time.perf_counter() - started
+            metrics.record_fill(policy.namespace, delta)
+            entry = _encode(policy, value, delta)
+            if value is not None or policy.negative_ttl > 0:
+                stored = redis_client.eval(_STORE_IF_UNCHANGED_SCRIPT, 2, key, version_key(key),
+                                           redis_version, entry.dump(policy.codec), _redis_ttl(entry))
+                # Не записали - ключ успели изменить; этому запросу отдаём прочитанное, но не кэшируем
+                if stored:
+                    l1.put(key, entry, version)
+            return entry
+        finally:
+            redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+    # Значение пересобирает другой воркер
+    if stale is not None:
+        return stale
+    deadline = time.monotonic() + CACHE_FILL_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_FILL_POLL_INTERVAL)
+        raw = redis_client.get(key)
+        entry = Entry.parse(raw, policy.codec) if raw is not None else None
+        if entry is not None:
+            return entry
+        if not redis_client.exists(lock_key):
+            break
+    return _encode(policy, loader())
+
+def _lookup(policy: CachePolicy, key: str, loader, cached=None):
+    if cached is None:
+        entry = l1.get(key)
+        if entry is not None and not entry.is_expired():
+            return "l1_hit", entry
+        version = l1.version
+        cached = redis_client.get(key)
+    else:
+        version = l1.version
+    entry = Entry.parse(cached, policy.codec) if cached is not None else None
+    if entry is not None and not entry.is_expired():
+        l1.put(key, entry, version)
+        return ("negative_hit" if entry.missing else "hit"), entry
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if entry is not None:
+            return "stale_hit", entry
+        if not flight.done.wait(CACHE_FILL_WAIT_TIMEOUT):
+            return "miss", _encode(policy, loader())
+        if flight.error is not None:
+            raise flight.error
+        return "hit", flight.entry
+
+    try:
+        flight.entry = _fill(policy, key, loader, entry)
+        return "miss", flight.entry
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+def get_entry(policy: CachePolicy, key: str, loader, cached=None) -> Entry:
+    """Запись из кэша или из результата loader(); loader возвращает None, если данных нет.
+
+    cached - уже прочитанное из Redis значение ключа (например, через MGET).
+    """
+    started = time.perf_counter()
+    outcome, entry = _lookup(policy, key, loader, cached)
+    metrics.record(policy.namespace, outcome, time.perf_counter() - started)
+    return entry
+
+def cached(policy: CachePolicy):
+    """Декоратор: результат функции кэшируется по ключу policy.key(<аргументы функции>).
+
+    Обёрнутая функция принимает необязательный cached_raw - уже прочитанное из Redis значение.
+    wrapper.raw(...) возвращает закодированное значение (None, если данных нет) - для
+    JSON-кодеков это готовое тело ответа.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def entry(args, kwargs, cached_raw):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = policy.key(**bound.arguments)
+            return get_entry(policy, key, lambda: func(*args, **kwargs), cached=cached_raw)
+
+        @wraps(func)
+        def wrapper(*args, cached_raw=None, **kwargs):
+            return entry(args, kwargs, cached_raw).value(policy.codec)
+
+        def raw(*args, cached_raw=None, **kwargs):
+            result = entry(args, kwargs, cached_raw)
+            if result.missing:
+                return None
+            if policy.codec.json_compatible:
+                return result.payload
+            return CODECS[RESPONSE_CODEC].dumps(result.value(policy.codec))
+
+        wrapper.policy = policy
+        wrapper.raw = raw
+        return wrapper
+    return decorator
+
+
+# Профили пользователей user:{id}. Пути записи (update/delete) сами обновляют
+# или удаляют ключ после commit, поэтому TTL может быть большим.
+USER_POLICY = CachePolicy(
+    "user", "{user_id}",
+    ttl=int(os.getenv("USER_CACHE_TTL", str(6 * 3600))),
+    negative_ttl=int(os.getenv("USER_CACHE_NEGATIVE_TTL", "30")),
+)
+
+def user_key(user_id: int) -> str:
+    return USER_POLICY.key(user_id=user_id)
+
+def user_to_dict(user) -> dict:
+    # Ровно поля UserResponse: закэшированное значение отдаётся клиенту без повторной валидации
+    return {
+        "id": user.id,
+        "full_name": user.full_name,
+    }
+
+# Список пользователей кэшируется сегментами по USERS_PAGE_SIZE записей.
+# Ключ сегмента содержит поколение: любое изменение пользователей увеличивает
+# users:gen, и все старые сегменты разом перестают читаться (и доживают до TTL).
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "100"))
+USERS_PAGE_POLICY = CachePolicy(
+    "users:page", "{generation}:{index}",
+    ttl=int(os.getenv("USERS_PAGE_TTL", "3600")),
+)
+USERS_GENERATION_KEY = "users:gen"
+
+def users_generation() -> int:
+    return int(redis_client.get(USERS_GENERATION_KEY) or 0)
+
+def users_page_key(generation: int, index: int) -> str:
+    return USERS_PAGE_POLICY.key(generation=generation, index=index)
+
+# Вызываются путями записи в main.py после commit
+def user_created(user) -> None:
+    # Убираем отметку об отсутствии (404), если этот id уже запрашивали
+    user_ids.add(user.id)
+    pipe = redis_client.pipeline()
+    pipe.delete(user_key(user.id))
+    invalidate(user_key(user.id), pipe=pipe)
+    pipe.publish(USER_BLOOM_CHANNEL, user.id)
+    pipe.incr(USERS_GENERATION_KEY)
+    pipe.execute()
+
+def user_updated(user) -> None:
+    # Перезаписываем профиль свежими данными и сбрасываем сегменты списка
+    pipe = redis_client.pipeline()
+    store(USER_POLICY, user_key(user.id), user_to_dict(user), pipe=pipe)
+    invalidate(user_key(user.id), pipe=pipe)
+    pipe.incr(USERS_GENERATION_KEY)
+    pipe.execute()
+
+def user_deleted(user_id: int) -> None:
+    pipe = redis_client.pipeline()
+    pipe.delete(user_key(user_id))
+    invalidate(user_key(user_id), pipe=pipe)
+    pipe.incr(USERS_GENERATION_KEY)
+    pipe.execute()
+
+def users_imported(ids) -> None:
+    # Массовая загрузка: то же, что user_created, для каждого id пачки одним пайплайном.
+    # Id рассылаются, а не "перестройте фильтр": до конца перестройки старый фильтр
+    # отвечал бы ложным 404 на только что загруженные id
+    for user_id in ids:
+        user_ids.add(user_id)
+    pipe = redis_client.pipeline()
+    for user_id in ids:
+        pipe.delete(user_key(user_id))
+        invalidate(user_key(user_id), pipe=pipe)
+        pipe.publish(USER_BLOOM_CHANNEL, user_id)
+    pipe.incr(USERS_GENERATION_KEY)
+    pipe.execute()
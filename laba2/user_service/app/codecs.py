@@ -0,0 +1,70 @@
+import json
+import os
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonCodec:
+    name = "json"
+    # Закодированное значение - готовое тело JSON-ответа
+    json_compatible = True
+
+    def dumps(self, value) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    def loads(self, raw: bytes):
+        return json.loads(raw)
+
+
+class OrjsonCodec:
+    name = "orjson"
+    json_compatible = True
+
+    def dumps(self, value) -> bytes:
+        return orjson.dumps(value)
+
+    def loads(self, raw: bytes):
+        return orjson.loads(raw)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    json_compatible = False
+
+    def dumps(self, value) -> bytes:
+        return msgpack.packb(value)
+
+    def loads(self, raw: bytes):
+        return msgpack.unpackb(raw)
+
+
+CODECS = {"json": JsonCodec()}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+# Кодек для ответов - всегда JSON; кодек для значений в Redis задаётся CACHE_CODEC
+RESPONSE_CODEC = "orjson" if orjson is not None else "json"
+DEFAULT_CODEC = os.getenv("CACHE_CODEC", RESPONSE_CODEC)
+
+
+class FastJSONResponse(Response):
+    """Как ORJSONResponse, но без жёсткой зависимости от orjson; bytes отдаются как есть."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return CODECS[RESPONSE_CODEC].dumps(content)
@@ -0,0 +1,152 @@
+import bisect
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Настройки пула соединений к Postgres (по умолчанию у SQLAlchemy: 5 + 10, без pre-ping и recycle)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Пересоздавать соединения старше DB_POOL_RECYCLE секунд (-1 - никогда)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# Границы корзин гистограмм, мс
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{bound}": n for bound, n in zip(self.bounds, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": self.total_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+            "buckets": buckets,
+        }
+
+
+class PoolMetrics:
+    """Ожидание соединения (checkout wait) и время удержания соединения запросом."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait = Histogram()
+        self.hold = Histogram()
+        self.counters = {"checkouts": 0, "timeouts": 0, "connects": 0, "invalidations": 0}
+
+    def record_wait(self, ms: float, timed_out: bool) -> None:
+        with self._lock:
+            self.wait.observe(ms)
+            self.counters["timeouts" if timed_out else "checkouts"] += 1
+
+    def record_hold(self, ms: float) -> None:
+        with self._lock:
+            self.hold.observe(ms)
+
+    def incr(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.counters, "wait": self.wait.snapshot(), "hold": self.hold.snapshot()}
+
+
+class _TimedPoolMixin:
+    # В событиях пула нет момента "начали ждать", поэтому время ожидания меряем вокруг connect()
+    metrics: PoolMetrics
+
+    def connect(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.metrics.record_wait((time.perf_counter() - started) * 1000, timed_out)
+
+    def recreate(self):
+        # engine.dispose() пересоздаёт пул - метрики переносим в новый
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(async_mode: bool = False) -> dict:
+    return {
+        "poolclass": TimedAsyncQueuePool if async_mode else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def instrument(engine) -> PoolMetrics:
+    """Подключает метрики к пулу движка (для AsyncEngine передавать engine.sync_engine)."""
+    metrics = PoolMetrics()
+    engine.pool.metrics = metrics
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.incr("connects")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checkout_at"] = time.perf_counter()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checkout_at = connection_record.info.pop("checkout_at", None)
+        if checkout_at is not None:
+            metrics.record_hold((time.perf_counter() - checkout_at) * 1000)
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.incr("invalidations")
+
+    return metrics
+
+
+def pool_stats(engine) -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": pool._max_overflow,
+        "timeout": pool._timeout,
+        "recycle": pool._recycle,
+        "pre_ping": pool._pre_ping,
+        **pool.metrics.snapshot(),
+    }
@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+from app.db_pool import Histogram
+
+# bcrypt считается в отдельных процессах: не занимает пул потоков Starlette и не держит GIL
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+# Сколько операций может ждать и выполняться одновременно; сверх лимита - сразу 503
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", "1"))
+
+# Первая схема - для новых хэшей, остальные только проверяются и при входе перехэшируются.
+# Стоимость подбирается под железо: python -m app.hashing --target-ms 250
+PASSWORD_SCHEMES = [s.strip() for s in os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",") if s.strip()]
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# argon2 требует пакет argon2-cffi
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # КиБ
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+
+def make_context(schemes=None, bcrypt_rounds=BCRYPT_ROUNDS, argon2_time_cost=ARGON2_TIME_COST,
+                 argon2_memory_cost=ARGON2_MEMORY_COST, argon2_parallelism=ARGON2_PARALLELISM) -> CryptContext:
+    schemes = schemes or PASSWORD_SCHEMES
+    settings = {}
+    if "bcrypt" in schemes:
+        # min = max = default: хэш с любой другой стоимостью needs_update() считает устаревшим
+        settings.update(bcrypt__default_rounds=bcrypt_rounds,
+                        bcrypt__min_rounds=bcrypt_rounds,
+                        bcrypt__max_rounds=bcrypt_rounds)
+    if "argon2" in schemes:
+        settings.update(argon2__time_cost=argon2_time_cost,
+                        argon2__memory_cost=argon2_memory_cost,
+                        argon2__parallelism=argon2_parallelism)
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+pwd_context = make_context()
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+# Выполняются в процессах пула. time.monotonic() общий для всех процессов хоста,
+# поэтому по отметкам можно отделить ожидание в очереди от самого хэширования.
+def _hash(password: str):
+    started = time.monotonic()
+    result = pwd_context.hash(password)
+    return result, started, time.monotonic()
+
+
+def _verify_and_update(password: str, password_hash: str):
+    # (верен ли пароль, новый хэш или None, если старый соответствует текущим настройкам)
+    started = time.monotonic()
+    result = pwd_context.verify_and_update(password, password_hash)
+    return result, started, time.monotonic()
+
+
+def hash_many(passwords):
+    # Для массового импорта: пачка паролей за один вызов, без метрик
+    return [pwd_context.hash(password) for password in passwords]
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class HashMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queue_wait = Histogram()
+        self.latency = {"hash": Histogram(), "verify": Histogram()}
+        self.rejected = 0
+
+    def record(self, operation: str, wait_ms: float, latency_ms: float) -> None:
+        with self._lock:
+            self.queue_wait.observe(wait_ms)
+            self.latency[operation].observe(latency_ms)
+
+    def record_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "rejected": self.rejected,
+                "queue_wait": self.queue_wait.snapshot(),
+                "latency": {name: h.snapshot() for name, h in self.latency.items()},
+            }
+
+
+metrics = HashMetrics()
+_executor: Optional[ProcessPoolExecutor] = None
+# Отправлено в пул и ещё не завершено; меняется только из event loop
+_in_flight = 0
+
+
+def start() -> None:
+    global _executor
+    # spawn, а не fork: воркеры не наследуют соединения с Postgres/Redis и потоки процесса
+    _executor = ProcessPoolExecutor(
+        max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+    # Поднимаем процессы заранее, чтобы первые логины не ждали их запуска
+    for _ in range(HASH_WORKERS):
+        _executor.submit(_warm_up)
+
+
+def stop() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _run(operation: str, func, *args):
+    global _in_flight
+    if _executor is None:
+        raise RuntimeError("Hash pool is not started, check the app lifespan")
+    if _in_flight >= HASH_QUEUE_LIMIT:
+        metrics.record_rejected()
+        raise HashPoolBusy()
+    _in_flight += 1
+    submitted = time.monotonic()
+    try:
+        result, started, finished = await asyncio.wrap_future(_executor.submit(func, *args))
+    finally:
+        _in_flight -= 1
+    metrics.record(operation, (started - submitted) * 1000, (finished - started) * 1000)
+    return result
+
+
+async def hash_password(password: str) -> str:
+    return await _run("hash", _hash, password)
+
+
+async def verify_and_update(password: str, password_hash: str):
+    return await _run("verify", _verify_and_update, password, password_hash)
+
+
+def stats() -> dict:
+    return {
+        "workers": HASH_WORKERS,
+        "queue_limit": HASH_QUEUE_LIMIT,
+        "schemes": PASSWORD_SCHEMES,
+        "in_flight": _in_flight,
+        **metrics.snapshot(),
+    }
+
+
+def _measure(context: CryptContext, samples: int) -> float:
+    # Медиана времени verify, мс; verify и hash для этих схем стоят одинаково
+    password_hash = context.hash("calibration-password")
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.verify("calibration-password", password_hash)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(scheme: str, target_ms: float, samples: int):
+    """Наибольшая стоимость, при которой verify укладывается в target_ms на этом хосте."""
+    if scheme == "bcrypt":
+        candidates = [({"bcrypt_rounds": rounds}, f"BCRYPT_ROUNDS={rounds}") for rounds in range(8, 17)]
+    else:
+        candidates = [({"argon2_time_cost": cost}, f"ARGON2_TIME_COST={cost}") for cost in range(1, 11)]
+    chosen = None
+    for params, setting in candidates:
+        ms = _measure(make_context([scheme], **params), samples)
+        print(f"{scheme} {setting}: {ms:.1f} ms")
+        if ms > target_ms:
+            break
+        chosen = setting
+    return chosen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Подбор стоимости хэширования паролей под целевое время verify")
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2"], default="bcrypt")
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+    if args.scheme == "argon2":
+        print(f"ARGON2_MEMORY_COST={ARGON2_MEMORY_COST} ARGON2_PARALLELISM={ARGON2_PARALLELISM}")
+    setting = calibrate(args.scheme, args.target_ms, args.samples)
+    if setting is None:
+        print(f"Even the cheapest {args.scheme} setting exceeds {args.target_ms} ms")
+    else:
+        print(f"\nPASSWORD_SCHEMES={args.scheme}\n{setting}")
@@ -1,190 +1,320 @@
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import List, Optional
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 
-from app import users_crud
-from app.models import User, UserCreate, UserResponse, get_db
+from app import async_routes, bulk_import, db_pool, hashing, users_crud
+from app.replicas import replica_set
+from app.auth import (ACCESS_TOKEN_EXPIRE_MINUTES, JWKS_MAX_AGE, create_access_token,
+                      get_current_user, get_jwks, token_cache)
+from app.models import (DB_MODE, SessionLocal, User, UserCreate, UserResponse, UserLookupRequest,
+                        UserLookupResponse, async_engine, engine, get_db, get_primary_db)
 
-import json
-from app.cache import redis_client
+import os
+from app import cache
+from app.codecs import CODECS, RESPONSE_CODEC, FastJSONResponse
+from app.cache import USERS_PAGE_SIZE, redis_client, users_generation, users_page_key
 
-SECRET_KEY = "your-secret-key"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+def load_user_ids():
+    # Bloom-фильтр строим по primary: id, которого ещё нет на реплике, дал бы ложный 404
+    db = SessionLocal(info={"primary": True})
+    try:
+        yield from users_crud.iter_user_ids(db)
+    finally:
+        db.close()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Подписка на канал инвалидации включает L1-кэш и Bloom-фильтр id этого воркера
+    cache.user_ids.loader = load_user_ids
+    cache.start_invalidation_listener()
+    replica_set.start()
+    hashing.start()
+    yield
+    hashing.stop()
+    bulk_import.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+app = FastAPI(lifespan=lifespan)
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# В async-режиме /token, /register, чтения и запись /users обслуживаются async-маршрутами
+# (регистрируются первыми); /userscache и служебные маршруты - sync в обоих режимах
+if DB_MODE == "async":
+    app.include_router(async_routes.router)
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
+# Пул хэширования переполнен - отказываем сразу, а не копим очередь
+@app.exception_handler(hashing.HashPoolBusy)
+def hash_pool_busy_handler(request: Request, exc: hashing.HashPoolBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many password operations, retry later"},
+        headers={"Retry-After": str(hashing.HASH_RETRY_AFTER)},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        else:
-            return username
-    except JWTError:
-        raise credentials_exception
-
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
 
+@app.exception_handler(bulk_import.ImportBusy)
+def import_busy_handler(request: Request, exc: bulk_import.ImportBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Another import is running, retry later"},
+        headers={"Retry-After": str(bulk_import.IMPORT_RETRY_AFTER)},
+    )
+
+# Открытые ключи для локальной проверки токенов другими сервисами
+@app.get("/.well-known/jwks.json")
+def read_jwks():
+    return JSONResponse(
+        content=get_jwks(),
+        headers={"Cache-Control": f"public, max-age={JWKS_MAX_AGE}"}
+    )
+
+@app.get("/internal/cache")
+def read_cache_stats():
+    return cache.metrics.snapshot()
+
+# Состояние пула соединений к Postgres: занятые/свободные, ожидание и удержание соединений
+@app.get("/internal/pool")
+def read_pool_stats():
+    stats = {"sync": db_pool.pool_stats(engine)}
+    if async_engine is not None:
+        stats["async"] = db_pool.pool_stats(async_engine.sync_engine)
+    if replica_set.replicas:
+        stats["replicas"] = replica_set.stats()
+    return stats
+
+@app.get("/internal/hashing")
+def read_hashing_stats():
+    return hashing.stats()
+
+@app.get("/internal/token-cache")
+def read_token_cache_stats():
+    return token_cache.stats()
+
+# Маршруты с bcrypt асинхронные: хэш считается в пуле процессов, запросы к базе - в пуле потоков
 @app.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_primary_db)
 ):
-    user = users_crud.get_user_by_login(db, form_data.username)
+    user = await run_in_threadpool(users_crud.get_user_by_login, db, form_data.username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if not pwd_context.verify(form_data.password, user.password_hash):
+    verified, new_hash = await hashing.verify_and_update(form_data.password, user.password_hash)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # Хэш сделан со старой схемой или стоимостью - заменяем, пока пароль известен
+    if new_hash is not None:
+        await run_in_threadpool(users_crud.update_password_hash, db, user.id, new_hash)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.login}, expires_delta=access_token_expires
+        # uid: chat_service берёт id из токена, а не по логину, который может смениться
+        data={"sub": user.login, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 # GET /users - Получить всех пользователей
+# after_id - постраничная выдача по id (ссылка на следующую страницу в заголовке Link),
+# skip оставлен для совместимости, но на дальних страницах он медленный.
+# Строки выбираются только нужными колонками и уже в формате UserResponse - отдаём их напрямую
 @app.get("/users", response_model=List[UserResponse])
-def read_users(skip: int = 0, limit: int = 100, 
+def read_users(request: Request,
+               skip: int = 0, limit: int = 100, after_id: Optional[int] = None,
                current_user: User = Depends(get_current_user), 
                db: Session = Depends(get_db)):
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+    if after_id is None:
+        return FastJSONResponse(users_crud.get_user_rows(db, skip, limit))
+    users = users_crud.get_users_after(db, after_id, limit)
+    headers = {}
+    if len(users) == limit:
+        next_url = request.url.remove_query_params("skip").include_query_params(after_id=users[-1]["id"])
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return FastJSONResponse(users, headers=headers)
 
+# Кэш заполняется только из primary: данные с отставшей реплики легли бы в кэш на весь TTL.
+# limit ограничен: на каждые USERS_PAGE_SIZE строк - отдельный ключ в одном MGET
 @app.get("/userscache", response_model=List[UserResponse])
-def read_userscache(skip: int = 0, limit: int = 100, 
+def read_userscache(skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000),
                current_user: User = Depends(get_current_user), 
-               db: Session = Depends(get_db)):
-    cached = redis_client.get("users:all")
-    if cached:
-            return json.loads(cached)
-
-    users = db.query(User).all()
-    print(users)
-    serialized = [
-        {
-            "id": u.id,
-            "login": u.login,
-            "full_name": u.full_name,
-            "email": u.email,
-        }
-        for u in users
-    ]
-    redis_client.set("users:all", json.dumps(serialized), ex=60)  # кэш на 60 секунд
-    return serialized
+               db: Session = Depends(get_primary_db)):
+    # Читаем из Redis только сегменты, которые покрывают [skip, skip + limit)
+    first = skip // USERS_PAGE_SIZE
+    last = (skip + limit - 1) // USERS_PAGE_SIZE
+    generation = users_generation()
+    indexes = range(first, last + 1)
+    keys = [users_page_key(generation, index) for index in indexes]
+    cached_pages = redis_client.mget(keys) if keys else []
+
+    pages = []
+    after_id = None
+    for index, cached_page in zip(indexes, cached_pages):
+        page = users_crud.get_users_page(db, generation, index, after_id, cached_raw=cached_page)
+        pages.append(page)
+        if not page:
+            break
+        after_id = page[-1]["id"]
+
+    rows = [row for page in pages for row in page]
+    offset = skip - first * USERS_PAGE_SIZE
+    return FastJSONResponse(rows[offset:offset + limit])
+
+# POST /users/lookup - Проверить существование сразу нескольких пользователей
+# primary: chat_service проверяет участников сразу после их регистрации, реплика могла отстать
+@app.post("/users/lookup", response_model=UserLookupResponse)
+def lookup_users(lookup: UserLookupRequest,
+                 current_user: User = Depends(get_current_user),
+                 db: Session = Depends(get_primary_db)):
+    ids = list(dict.fromkeys(lookup.ids))
+    # id, которых нет в Bloom-фильтре, точно не существуют - в базу их не отправляем
+    candidates = [i for i in ids if cache.user_ids.might_contain(i)]
+    existing = users_crud.get_existing_ids(db, candidates) if candidates else set()
+    return {
+        "found": [i for i in ids if i in existing],
+        "missing": [i for i in ids if i not in existing],
+    }
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+def _export_lines(id_from, id_to, created_from, created_to):
+    # Своя сессия: генератор дочитывается уже после выхода из обработчика.
+    # Чтение можно отдать реплике - это обычный SELECT
+    dumps = CODECS[RESPONSE_CODEC].dumps
+    db = SessionLocal()
+    try:
+        for rows in users_crud.iter_users_export(db, EXPORT_BATCH_SIZE, id_from, id_to,
+                                                 created_from, created_to):
+            yield b"".join(
+                dumps({
+                    "id": row.id,
+                    "login": row.login,
+                    "full_name": row.full_name,
+                    "email": row.email,
+                    "created_at": row.created_at.isoformat() if row.created_at else None,
+                }) + b"\n"
+                for row in rows
+            )
+    finally:
+        db.close()
+
+# GET /users/export - Выгрузка пользователей в NDJSON потоком, память не зависит от размера таблицы.
+# Фильтры: id_from/id_to (включительно), created_from (включительно)/created_to (не включая)
+@app.get("/users/export")
+def export_users(id_from: Optional[int] = None, id_to: Optional[int] = None,
+                 created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                 current_user: User = Depends(get_current_user)):
+    return StreamingResponse(
+        _export_lines(id_from, id_to, created_from, created_to),
+        media_type="application/x-ndjson",
+    )
+
+# POST /users/import - Массовая загрузка пользователей: NDJSON (по умолчанию) или CSV с заголовком.
+# Поля: login, full_name, email и password или готовый password_hash; ошибки - по номерам строк
+@app.post("/users/import")
+async def import_users(request: Request,
+                       format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+                       current_user: User = Depends(get_current_user)):
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    return await bulk_import.import_stream(engine, request.stream(), fmt)
+
+# GET /users/by-login/{login} - Получить пользователя по логину (нужен chat_service для sub -> id)
+# primary: токен только что выдан по логину из primary - на отставшей реплике был бы ложный 404
+@app.get("/users/by-login/{login:path}", response_model=UserResponse)
+def read_user_by_login(login: str,
+                       current_user: User = Depends(get_current_user),
+                       db: Session = Depends(get_primary_db)):
+    db_user = users_crud.get_user_row_by_login(db, login)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return FastJSONResponse(db_user)
 
 # GET /users/{user_id} - Получить пользователя по ID
 @app.get("/users/{user_id}", response_model=UserResponse)
 def read_user(user_id: int,
               current_user: User = Depends(get_current_user), 
               db: Session = Depends(get_db)):
-    db_user = users_crud.get_user(db, user_id)
+    db_user = users_crud.get_user_row(db, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    return FastJSONResponse(db_user)
 
 @app.get("/userscache/{user_id}", response_model=UserResponse)
 def read_usercache(user_id: int,
               current_user: User = Depends(get_current_user),
-              db: Session = Depends(get_db)):
-    cache_key = f"user:{user_id}"
-    if redis_client.exists(cache_key):
-        cached_user = redis_client.get(cache_key)
-        return json.loads(cached_user)
-    
-    db_user = users_crud.get_user(db, user_id)
-    if db_user is None:
+              db: Session = Depends(get_primary_db)):
+    if not cache.user_ids.might_contain(user_id):
         raise HTTPException(status_code=404, detail="User not found")
+    # Закэшированное значение уже в формате UserResponse - отдаём байты из кэша как есть
+    payload = users_crud.get_user_profile.raw(db, user_id)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return FastJSONResponse(payload)
 
-    user_dict = {
-        "id": db_user.id,
-        "login": db_user.login,
-        "full_name": db_user.full_name,
-        "email": db_user.email
-    }
-
-    redis_client.set(cache_key, json.dumps(user_dict), ex=180)
-    return user_dict
+def _insert_user(db: Session, user_data: UserCreate, password_hash: str):
+    row = users_crud.insert_user(db, user_data.login, user_data.full_name, user_data.email, password_hash)
+    if row is not None:
+        cache.user_created(row)
+    return row
 
+# Одна команда INSERT ... ON CONFLICT (login) DO NOTHING RETURNING вместо SELECT + INSERT + refresh.
+# Хэш считается до проверки логина: повторная регистрация занятого логина - редкий случай
 @app.post("/register", response_model=UserResponse)
-def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
-    print(user_data)
-    existing_user = db.query(User).filter(User.login == user_data.login).first()
-    if existing_user:
+async def register_user(user_data: UserCreate, db: Session = Depends(get_primary_db)):
+    hashed_password = await hashing.hash_password(user_data.password)
+    try:
+        new_user = await run_in_threadpool(_insert_user, db, user_data, hashed_password)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid user data")
+    if new_user is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User with this login already exists"
         )
+    return FastJSONResponse(new_user._asdict())
 
-    hashed_password = pwd_context.hash(user_data.password)
-    new_user = User(
-        login=user_data.login,
-        full_name=user_data.full_name,
-        email=user_data.email,
-        password_hash=hashed_password
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
-
-# PUT /users/{user_id} - Обновить пользователя по ID
+# PUT /users/{user_id} - Обновить пользователя по ID (UPDATE ... RETURNING)
 @app.put("/users/{user_id}", response_model=UserResponse)
 def update_user(user_id: int, updated_data: UserCreate,
                 current_user: User = Depends(get_current_user),
-                db: Session = Depends(get_db)):
-    db_user = users_crud.get_user(db, user_id)
+                db: Session = Depends(get_primary_db)):
+    # Пароль здесь не обновляется — для этого можно добавить отдельную логику
+    try:
+        db_user = users_crud.update_user(db, user_id, updated_data.login,
+                                         updated_data.full_name, updated_data.email)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User with this login already exists"
+        )
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    # Обновляем данные (обратите внимание, что пароль здесь не обновляется — для этого можно добавить отдельную логику)
-    db_user.login = updated_data.login
-    db_user.full_name = updated_data.full_name
-    db_user.email = updated_data.email
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-# DELETE /users/{user_id} - Удалить пользователя по ID
+    cache.user_updated(db_user)
+    return FastJSONResponse(db_user._asdict())
+
+# DELETE /users/{user_id} - Удалить пользователя по ID (DELETE ... RETURNING)
 @app.delete("/users/{user_id}", response_model=UserResponse)
 def delete_user(user_id: int,
                 current_user: User = Depends(get_current_user),
-                db: Session = Depends(get_db)):
-    db_user = users_crud.get_user(db, user_id)
+                db: Session = Depends(get_primary_db)):
+    db_user = users_crud.delete_user(db, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(db_user)
-    db.commit()
-    return db_user
+    cache.user_deleted(user_id)
+    return FastJSONResponse(db_user._asdict())
 
 # Запуск сервера
 # http://localhost:8000/openapi.json swagger
@@ -1,14 +1,35 @@
 import time
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List
 from sqlalchemy import create_engine, Column, Integer, String, TIMESTAMP
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 import os
 
+from app import db_pool
+from app.replicas import RoutingSession
+
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/userdb")
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **db_pool.pool_options())
+db_pool.instrument(engine)
+
+# Чтения распределяются по репликам из REPLICA_DATABASE_URLS (если заданы), запись - в primary
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# DB_MODE=async - маршруты чтения идут через asyncpg без пула потоков Starlette,
+# DB_MODE=sync - как раньше, psycopg2 + Session (для сравнения под нагрузкой)
+DB_MODE = os.getenv("DB_MODE", "sync")
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+)
+# Движок создаётся только в async-режиме, чтобы sync-режиму не был нужен asyncpg
+async_engine = None
+if DB_MODE == "async":
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **db_pool.pool_options(async_mode=True))
+    db_pool.instrument(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 Base = declarative_base()
 
 class User(Base):
@@ -36,6 +57,13 @@ class UserResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class UserLookupRequest(BaseModel):
+    ids: List[int] = Field(max_length=1000)
+
+class UserLookupResponse(BaseModel):
+    found: List[int]
+    missing: List[int]
+
 try:
     Base.metadata.create_all(bind=engine)
 except:
@@ -47,4 +75,16 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()    
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Для записи и для чтений, которым нельзя видеть отставшую реплику
+def get_primary_db():
+    db = SessionLocal(info={"primary": True})
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,122 @@
+import itertools
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from app import db_pool
+
+# Реплики только для чтения, через запятую; пусто - всё идёт в primary
+REPLICA_DATABASE_URLS = [url.strip() for url in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if url.strip()]
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "5"))
+# Максимально допустимое отставание реплики, с (0 - не проверять; только для Postgres)
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "10"))
+
+# Время с последней применённой транзакции растёт и на догнавшей реплике, если в primary
+# давно не было записей, - поэтому при равенстве полученного и применённого WAL отставание 0
+LAG_QUERY = text(
+    "SELECT CASE "
+    "WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_engine(url, **db_pool.pool_options())
+        db_pool.instrument(self.engine)
+        # Пока проверка не прошла, реплика считается недоступной - чтения идут в primary
+        self.healthy = False
+        self.lag = None
+        self.last_error = None
+        self.checked_at = None
+
+    def check(self) -> None:
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == "postgresql":
+                    self.lag = float(conn.execute(LAG_QUERY).scalar())
+                else:
+                    conn.execute(text("SELECT 1"))
+            self.healthy = not (REPLICA_MAX_LAG and self.lag is not None and self.lag > REPLICA_MAX_LAG)
+            self.last_error = None if self.healthy else f"lag {self.lag:.1f}s > {REPLICA_MAX_LAG}s"
+        except Exception as exc:
+            self.healthy = False
+            self.last_error = str(exc).splitlines()[0]
+        self.checked_at = time.time()
+
+    def stats(self) -> dict:
+        return {
+            "url": self.engine.url.render_as_string(hide_password=True),
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "last_error": self.last_error,
+            "checked_at": self.checked_at,
+            "pool": db_pool.pool_stats(self.engine),
+        }
+
+
+class ReplicaSet:
+    """Реплики с фоновой проверкой доступности; choose() - по кругу среди живых."""
+
+    def __init__(self, urls):
+        self.replicas = [Replica(url) for url in urls]
+        self._counter = itertools.count()
+        self._thread = None
+
+    def choose(self):
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)].engine
+
+    def check_all(self) -> None:
+        for replica in self.replicas:
+            replica.check()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(REPLICA_CHECK_INTERVAL)
+            self.check_all()
+
+    def start(self) -> None:
+        if not self.replicas or self._thread is not None:
+            return
+        self.check_all()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stats(self) -> list:
+        return [r.stats() for r in self.replicas]
+
+
+replica_set = ReplicaSet(REPLICA_DATABASE_URLS)
+
+
+class RoutingSession(Session):
+    """SELECT уходят на реплику, всё остальное - в primary.
+
+    После первой записи - flush или insert/update/delete через execute() - сессия
+    до конца запроса читает только из primary, чтобы видеть свои же изменения.
+    info={"primary": True} - сразу только primary.
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        if not self.info.get("primary"):
+            if isinstance(clause, Select) and not self._flushing:
+                replica = replica_set.choose()
+                if replica is not None:
+                    return replica
+            elif clause is not None:
+                # Core DML (и text()) не проходит через flush, поэтому after_flush его не видит
+                self.info["primary"] = True
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _pin_to_primary(session, flush_context):
+    session.info["primary"] = True
@@ -1,15 +1,112 @@
+from typing import List
+from sqlalchemy import Integer, any_, bindparam, delete, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from .models import User, UserCreate
-from passlib.context import CryptContext
+from .cache import USER_POLICY, USERS_PAGE_POLICY, USERS_PAGE_SIZE, cached
+from .hashing import pwd_context
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Поля UserResponse. Чтения для ответов выбирают только их: без password_hash,
+# без ORM-объектов в identity map и без конвертации через orm_mode
+USER_RESPONSE_COLUMNS = (User.id, User.full_name)
 
 def get_user(db: Session, user_id: int):
     return db.query(User).filter(User.id == user_id).first()
 
+def get_user_row(db: Session, user_id: int):
+    row = db.execute(select(*USER_RESPONSE_COLUMNS).where(User.id == user_id)).first()
+    return row._asdict() if row is not None else None
+
+def get_user_rows(db: Session, skip: int, limit: int):
+    stmt = select(*USER_RESPONSE_COLUMNS).order_by(User.id).offset(skip).limit(limit)
+    return [row._asdict() for row in db.execute(stmt)]
+
+def get_users_after(db: Session, after_id: int, limit: int):
+    # Keyset-пагинация по первичному ключу: WHERE id > :after_id ORDER BY id LIMIT :limit
+    stmt = select(*USER_RESPONSE_COLUMNS).where(User.id > after_id).order_by(User.id).limit(limit)
+    return [row._asdict() for row in db.execute(stmt)]
+
+@cached(USER_POLICY)
+def get_user_profile(db: Session, user_id: int):
+    return get_user_row(db, user_id)
+
+@cached(USERS_PAGE_POLICY)
+def get_users_page(db: Session, generation: int, index: int, after_id: int = None):
+    # Если известен последний id предыдущего сегмента, грузим по id, а не через OFFSET
+    if after_id is not None:
+        return get_users_after(db, after_id, USERS_PAGE_SIZE)
+    return get_user_rows(db, index * USERS_PAGE_SIZE, USERS_PAGE_SIZE)
+
 def get_user_by_login(db: Session, login: str):
     return db.query(User).filter(User.login == login).first()
 
+# Записи одной командой с RETURNING: без предварительного SELECT и без db.refresh.
+# Возвращают строку (id, full_name) или None, если логин занят / пользователя нет.
+
+def insert_user(db: Session, login: str, full_name: str, email: str, password_hash: str):
+    stmt = (
+        insert(User)
+        .values(login=login, full_name=full_name, email=email, password_hash=password_hash)
+        .on_conflict_do_nothing(index_elements=[User.login])
+        .returning(*USER_RESPONSE_COLUMNS)
+    )
+    row = db.execute(stmt).first()
+    db.commit()
+    return row
+
+def update_user(db: Session, user_id: int, login: str, full_name: str, email: str):
+    # Занятый login даст IntegrityError - его обрабатывает вызывающий код
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .values(login=login, full_name=full_name, email=email)
+        .returning(*USER_RESPONSE_COLUMNS)
+    )
+    row = db.execute(stmt).first()
+    db.commit()
+    return row
+
+def delete_user(db: Session, user_id: int):
+    row = db.execute(delete(User).where(User.id == user_id).returning(*USER_RESPONSE_COLUMNS)).first()
+    db.commit()
+    return row
+
+def update_password_hash(db: Session, user_id: int, password_hash: str):
+    db.query(User).filter(User.id == user_id).update({User.password_hash: password_hash})
+    db.commit()
+
+def get_user_row_by_login(db: Session, login: str):
+    row = db.execute(select(*USER_RESPONSE_COLUMNS).where(User.login == login)).first()
+    return row._asdict() if row is not None else None
+
+# Поля выгрузки: всё, кроме password_hash
+USER_EXPORT_COLUMNS = (User.id, User.login, User.full_name, User.email, User.created_at)
+
+def iter_users_export(db: Session, batch_size: int, id_from: int = None, id_to: int = None,
+                      created_from=None, created_to=None):
+    # Серверный курсор (stream_results): в памяти одновременно не больше batch_size строк
+    stmt = select(*USER_EXPORT_COLUMNS).order_by(User.id)
+    if id_from is not None:
+        stmt = stmt.where(User.id >= id_from)
+    if id_to is not None:
+        stmt = stmt.where(User.id <= id_to)
+    if created_from is not None:
+        stmt = stmt.where(User.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(User.created_at < created_to)
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+    return result.partitions()
+
+def iter_user_ids(db: Session):
+    # Все id потоком, без загрузки таблицы в память (для Bloom-фильтра)
+    return db.execute(select(User.id).execution_options(yield_per=10000)).scalars()
+
+def get_existing_ids(db: Session, user_ids: List[int]) -> set:
+    # Один запрос WHERE id = ANY(:ids) вместо запроса на каждый id
+    stmt = select(User.id).where(User.id == any_(bindparam("ids", user_ids, type_=ARRAY(Integer))))
+    return set(db.scalars(stmt))
+
 def create_user(db: Session, user_data: UserCreate):
     hashed_password = pwd_context.hash(user_data.password)
     db_user = User(
@@ -22,3 +119,61 @@ def create_user(db: Session, user_data: UserCreate):
     db.commit()
     db.refresh(db_user)
     return db_user
+
+# Async-варианты для DB_MODE=async (AsyncSession + asyncpg)
+
+async def get_user_row_async(db: AsyncSession, user_id: int):
+    row = (await db.execute(select(*USER_RESPONSE_COLUMNS).where(User.id == user_id))).first()
+    return row._asdict() if row is not None else None
+
+async def get_user_rows_async(db: AsyncSession, skip: int, limit: int):
+    stmt = select(*USER_RESPONSE_COLUMNS).order_by(User.id).offset(skip).limit(limit)
+    return [row._asdict() for row in await db.execute(stmt)]
+
+async def get_users_after_async(db: AsyncSession, after_id: int, limit: int):
+    stmt = select(*USER_RESPONSE_COLUMNS).where(User.id > after_id).order_by(User.id).limit(limit)
+    return [row._asdict() for row in await db.execute(stmt)]
+
+async def get_user_row_by_login_async(db: AsyncSession, login: str):
+    row = (await db.execute(select(*USER_RESPONSE_COLUMNS).where(User.login == login))).first()
+    return row._asdict() if row is not None else None
+
+async def get_existing_ids_async(db: AsyncSession, user_ids: List[int]) -> set:
+    stmt = select(User.id).where(User.id == any_(bindparam("ids", user_ids, type_=ARRAY(Integer))))
+    return set(await db.scalars(stmt))
+
+async def get_user_by_login_async(db: AsyncSession, login: str):
+    # Для /token: только поля, нужные для проверки пароля и выдачи токена
+    stmt = select(User.id, User.login, User.password_hash).where(User.login == login)
+    return (await db.execute(stmt)).first()
+
+async def insert_user_async(db: AsyncSession, login: str, full_name: str, email: str, password_hash: str):
+    stmt = (
+        insert(User)
+        .values(login=login, full_name=full_name, email=email, password_hash=password_hash)
+        .on_conflict_do_nothing(index_elements=[User.login])
+        .returning(*USER_RESPONSE_COLUMNS)
+    )
+    row = (await db.execute(stmt)).first()
+    await db.commit()
+    return row
+
+async def update_user_async(db: AsyncSession, user_id: int, login: str, full_name: str, email: str):
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .values(login=login, full_name=full_name, email=email)
+        .returning(*USER_RESPONSE_COLUMNS)
+    )
+    row = (await db.execute(stmt)).first()
+    await db.commit()
+    return row
+
+async def delete_user_async(db: AsyncSession, user_id: int):
+    row = (await db.execute(delete(User).where(User.id == user_id).returning(*USER_RESPONSE_COLUMNS))).first()
+    await db.commit()
+    return row
+
+async def update_password_hash_async(db: AsyncSession, user_id: int, password_hash: str):
+    await db.execute(update(User).where(User.id == user_id).values(password_hash=password_hash))
+    await db.commit()
@@ -0,0 +1,339 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+from app import cache
+from app.cache import (USER_POLICY, BloomFilter, CachePolicy, Entry, LocalCache, UserIdFilter,
+                       cached, get_entry, user_key)
+from app.codecs import CODECS
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch):
+    # Свой сервер на тест: поток слушателя из прошлого теста не видит новых сообщений
+    client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(cache, "redis_client", client)
+    cache.l1.clear()
+    yield client
+    cache.l1.enabled = False
+    cache.l1.clear()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def read_user(user_id, loader):
+    return get_entry(USER_POLICY, user_key(user_id), loader).value(USER_POLICY.codec)
+
+
+def cached_user(redis_client, user_id):
+    raw = redis_client.get(user_key(user_id))
+    return cache.Entry.parse(raw, USER_POLICY.codec).value(USER_POLICY.codec) if raw else None
+
+
+def test_fill_stores_loaded_value(redis_client):
+    assert read_user(7, lambda: {"id": 7, "full_name": "Ann"}) == {"id": 7, "full_name": "Ann"}
+    assert cached_user(redis_client, 7) == {"id": 7, "full_name": "Ann"}
+
+
+def test_update_during_fill_is_not_overwritten(redis_client):
+    # Заполнение прочитало строку до commit, а update успел записать новую
+    def loader():
+        cache.user_updated(SimpleNamespace(id=7, full_name="new"))
+        return {"id": 7, "full_name": "old"}
+
+    assert read_user(7, loader) == {"id": 7, "full_name": "old"}
+    assert cached_user(redis_client, 7) == {"id": 7, "full_name": "new"}
+    assert read_user(7, lambda: pytest.fail("must be served from cache")) == {"id": 7, "full_name": "new"}
+
+
+def test_delete_during_fill_does_not_resurrect_profile(redis_client):
+    def loader():
+        cache.user_deleted(7)
+        return {"id": 7, "full_name": "old"}
+
+    read_user(7, loader)
+    assert redis_client.get(user_key(7)) is None
+
+
+def test_fill_after_write_is_stored(redis_client):
+    cache.user_deleted(7)
+    read_user(7, lambda: None)
+    cache.user_created(SimpleNamespace(id=7, full_name="Ann"))
+    assert read_user(7, lambda: {"id": 7, "full_name": "Ann"}) == {"id": 7, "full_name": "Ann"}
+    assert cached_user(redis_client, 7) == {"id": 7, "full_name": "Ann"}
+
+
+def test_listener_handles_invalidations_while_bloom_rebuilds(monkeypatch):
+    monkeypatch.setattr(cache, "USER_BLOOM_FILTER", True)
+    user_ids = cache.UserIdFilter()
+    monkeypatch.setattr(cache, "user_ids", user_ids)
+    release = threading.Event()
+
+    def slow_loader():
+        release.wait(5)
+        yield 7
+
+    user_ids.loader = slow_loader
+    threading.Thread(target=cache._listen_invalidations, daemon=True).start()
+    assert wait_for(lambda: cache.l1.enabled)
+
+    read_user(7, lambda: {"id": 7, "full_name": "old"})
+    assert cache.l1.get(user_key(7)) is not None
+    # Перестройка ещё читает id, а инвалидация от другого воркера уже должна дойти
+    cache.redis_client.publish(cache.CACHE_INVALIDATION_CHANNEL, user_key(7))
+    try:
+        assert wait_for(lambda: cache.l1.get(user_key(7)) is None)
+        assert not user_ids.ready
+    finally:
+        release.set()
+    assert wait_for(lambda: user_ids.ready)
+
+
+# Формат записи в Redis
+
+def test_entry_round_trip_keeps_payload_with_colons():
+    codec = CODECS["json"]
+    entry = Entry(b'{"url":"http://x:1"}', 0.25, 1700000000.5)
+    parsed = Entry.parse(entry.dump(codec), codec)
+    assert parsed.payload == entry.payload
+    assert parsed.delta == pytest.approx(0.25)
+    assert parsed.expires_at == pytest.approx(1700000000.5)
+    assert parsed.value(codec) == {"url": "http://x:1"}
+
+
+def test_entry_from_other_codec_is_a_miss():
+    raw = Entry(b"{}", 0, 0).dump(CODECS["json"])
+
+    class OtherCodec:
+        name = "other"
+
+    assert Entry.parse(raw, OtherCodec()) is None
+
+
+def test_missing_entry_has_empty_payload():
+    entry = Entry.parse(Entry(b"", 0, 0).dump(CODECS["json"]), CODECS["json"])
+    assert entry.missing
+    assert entry.value(CODECS["json"]) is None
+
+
+# Отметки об отсутствии (404)
+
+def test_missing_value_is_cached_when_negative_ttl_is_set(redis_client):
+    calls = []
+    policy = CachePolicy("t", "{id}", ttl=60, negative_ttl=30, codec="json")
+    for _ in range(2):
+        assert get_entry(policy, "t:1", lambda: calls.append(1)).missing
+    assert len(calls) == 1
+
+
+def test_missing_value_is_not_cached_without_negative_ttl(redis_client):
+    policy = CachePolicy("t", "{id}", ttl=60, codec="json")
+    get_entry(policy, "t:1", lambda: None)
+    assert redis_client.get("t:1") is None
+
+
+# Раннее истечение (XFetch)
+
+def test_fresh_entry_without_fill_cost_is_not_expired():
+    assert not Entry(b"1", 0.0, time.time() + 60).is_expired()
+    assert Entry(b"1", 0.0, time.time() - 1).is_expired()
+
+
+def test_expensive_entry_expires_early(monkeypatch):
+    # -delta * beta * ln(1 - 0.999) ~ 6.9 * delta: 10 с пересборки перекрывают 30 с до срока
+    monkeypatch.setattr(cache.random, "random", lambda: 0.999)
+    assert Entry(b"1", 10.0, time.time() + 30).is_expired()
+    monkeypatch.setattr(cache, "CACHE_EARLY_EXPIRY_BETA", 0.0)
+    assert not Entry(b"1", 10.0, time.time() + 30).is_expired()
+
+
+# Блокировка lock:{key} между воркерами
+
+def stale_entry(redis_client, key, value):
+    codec = USER_POLICY.codec
+    redis_client.set(key, Entry(codec.dumps(value), 0.0, time.time() - 1).dump(codec))
+
+
+def test_fill_releases_lock(redis_client):
+    read_user(7, lambda: {"id": 7, "full_name": "Ann"})
+    assert not redis_client.exists("lock:user:7")
+
+
+def test_stale_value_is_served_while_other_worker_fills(redis_client):
+    stale_entry(redis_client, user_key(7), {"id": 7, "full_name": "stale"})
+    redis_client.set("lock:user:7", "other-worker")
+    assert read_user(7, lambda: pytest.fail("other worker is filling")) == {"id": 7, "full_name": "stale"}
+    assert redis_client.get("lock:user:7") == b"other-worker"
+
+
+def test_waits_for_value_filled_by_other_worker(redis_client):
+    redis_client.set("lock:user:7", "other-worker")
+
+    def other_worker():
+        time.sleep(0.1)
+        cache.store(USER_POLICY, user_key(7), {"id": 7, "full_name": "Ann"})
+
+    threading.Thread(target=other_worker).start()
+    assert read_user(7, lambda: pytest.fail("other worker is filling")) == {"id": 7, "full_name": "Ann"}
+
+
+def test_loads_itself_when_other_worker_gives_up(redis_client):
+    redis_client.set("lock:user:7", "other-worker", px=100)
+    assert read_user(7, lambda: {"id": 7, "full_name": "Ann"}) == {"id": 7, "full_name": "Ann"}
+
+
+# Single-flight внутри процесса
+
+def test_concurrent_misses_call_loader_once(redis_client):
+    calls = []
+    barrier = threading.Barrier(8)
+    results = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"id": 7, "full_name": "Ann"}
+
+    def reader():
+        barrier.wait()
+        results.append(read_user(7, loader))
+
+    threads = [threading.Thread(target=reader) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"id": 7, "full_name": "Ann"}] * 8
+
+
+def test_loader_error_reaches_waiting_readers(redis_client):
+    started = threading.Event()
+    errors = []
+
+    def failing_loader():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("db down")
+
+    def reader(loader):
+        try:
+            read_user(7, loader)
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    leader = threading.Thread(target=reader, args=(failing_loader,))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=reader, args=(lambda: pytest.fail("leader is loading"),))
+    follower.start()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2
+
+
+# Декоратор @cached
+
+def test_cached_decorator_returns_raw_json(redis_client):
+    policy = CachePolicy("t", "{item_id}", ttl=60, negative_ttl=30, codec="json")
+
+    @cached(policy)
+    def load(item_id):
+        return {"id": item_id} if item_id == 1 else None
+
+    assert load(1) == {"id": 1}
+    assert load.raw(1) == b'{"id":1}'
+    assert load.raw(2) is None
+    assert redis_client.exists("t:1") and redis_client.exists("t:2")
+
+
+# L1
+
+def test_l1_skips_value_read_before_invalidation():
+    l1 = LocalCache(10, 30)
+    l1.enabled = True
+    version = l1.version
+    l1.delete("user:7")
+    l1.put("user:7", "old", version)
+    assert l1.get("user:7") is None
+    l1.put("user:7", "new", l1.version)
+    assert l1.get("user:7") == "new"
+
+
+def test_l1_evicts_least_recently_used_and_expires():
+    l1 = LocalCache(2, 30)
+    l1.enabled = True
+    for key in ("a", "b"):
+        l1.put(key, key, l1.version)
+    l1.get("a")
+    l1.put("c", "c", l1.version)
+    assert l1.get("b") is None and l1.get("a") == "a" and l1.get("c") == "c"
+
+    expired = LocalCache(2, 0)
+    expired.enabled = True
+    expired.put("a", "a", expired.version)
+    assert expired.get("a") is None
+
+
+def test_disabled_l1_stores_nothing():
+    l1 = LocalCache(10, 30)
+    l1.put("a", "a", l1.version)
+    l1.enabled = True
+    assert l1.get("a") is None
+
+
+# Bloom-фильтр
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(i)
+    assert all(i in bloom for i in range(1000))
+    false_positives = sum(i in bloom for i in range(1000, 11000))
+    assert false_positives < 300
+
+
+def test_user_id_filter_is_permissive_until_built():
+    user_ids = UserIdFilter()
+    assert user_ids.might_contain(42)
+    user_ids.loader = lambda: iter([1, 2])
+    user_ids.rebuild()
+    assert user_ids.might_contain(1)
+    assert not user_ids.might_contain(42)
+
+
+def test_ids_added_during_rebuild_are_kept():
+    user_ids = UserIdFilter()
+
+    def loader():
+        yield 1
+        user_ids.add(500)
+
+    user_ids.loader = loader
+    user_ids.rebuild()
+    assert user_ids.might_contain(1) and user_ids.might_contain(500)
+
+
+def test_imported_ids_are_visible_at_once_and_tombstones_cleared(redis_client, monkeypatch):
+    user_ids = UserIdFilter()
+    user_ids.loader = lambda: iter([1])
+    user_ids.rebuild()
+    monkeypatch.setattr(cache, "user_ids", user_ids)
+    # До импорта id 500 запрашивали - лежит отметка 404
+    assert read_user(500, lambda: None) is None
+    assert redis_client.exists(user_key(500))
+
+    cache.users_imported([500, 501])
+    assert user_ids.might_contain(500) and user_ids.might_contain(501)
+    assert not redis_client.exists(user_key(500))
+    assert read_user(500, lambda: {"id": 500, "full_name": "Imported"}) == {"id": 500, "full_name": "Imported"}
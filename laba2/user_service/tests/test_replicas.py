@@ -0,0 +1,95 @@
+import pytest
+from sqlalchemy import Column, Integer, String, create_engine, insert, select, text, update
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from app import replicas
+from app.replicas import ReplicaSet, RoutingSession
+
+# Две SQLite-базы вместо primary и реплики: в каждой своя строка, по ней видно, куда ушёл запрос
+Base = declarative_base()
+
+
+class Node(Base):
+    __tablename__ = "node"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(20), nullable=False)
+
+
+def make_db(path, name):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Node).values(id=1, name=name))
+    return engine
+
+
+@pytest.fixture
+def primary(tmp_path):
+    return make_db(tmp_path / "primary.db", "primary")
+
+
+@pytest.fixture
+def replica_set(tmp_path, monkeypatch):
+    make_db(tmp_path / "replica.db", "replica")
+    replica_set = ReplicaSet([f"sqlite:///{tmp_path / 'replica.db'}"])
+    monkeypatch.setattr(replicas, "replica_set", replica_set)
+    return replica_set
+
+
+@pytest.fixture
+def make_session(primary):
+    return sessionmaker(class_=RoutingSession, autoflush=False, bind=primary)
+
+
+def read_name(session):
+    return session.scalar(select(Node.name).where(Node.id == 1))
+
+
+def test_reads_go_to_healthy_replica(replica_set, make_session):
+    replica_set.check_all()
+    with make_session() as session:
+        assert read_name(session) == "replica"
+        assert "primary" not in session.info
+
+
+def test_unchecked_or_failed_replica_falls_back_to_primary(replica_set, make_session):
+    with make_session() as session:
+        assert read_name(session) == "primary"
+    replica_set.replicas[0].healthy = False
+    with make_session() as session:
+        assert read_name(session) == "primary"
+
+
+def test_primary_only_session(replica_set, make_session):
+    replica_set.check_all()
+    with make_session(info={"primary": True}) as session:
+        assert read_name(session) == "primary"
+
+
+def test_core_dml_pins_session_to_primary(replica_set, make_session):
+    replica_set.check_all()
+    with make_session() as session:
+        assert read_name(session) == "replica"
+        session.execute(update(Node).where(Node.id == 1).values(name="updated"))
+        assert session.info["primary"] is True
+        # Своя запись видна сразу, хотя реплика её ещё не получила
+        assert read_name(session) == "updated"
+        session.commit()
+        assert read_name(session) == "updated"
+
+
+def test_text_statement_pins_session_to_primary(replica_set, make_session):
+    replica_set.check_all()
+    with make_session() as session:
+        session.execute(text("UPDATE node SET name = 'raw' WHERE id = 1"))
+        assert read_name(session) == "raw"
+
+
+def test_flush_pins_session_to_primary(replica_set, make_session):
+    replica_set.check_all()
+    with make_session() as session:
+        session.add(Node(id=2, name="new"))
+        session.flush()
+        assert session.info["primary"] is True
+        assert session.scalar(select(Node.name).where(Node.id == 2)) == "new"